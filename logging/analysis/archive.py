@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Convert participant logs into a Parquet archive partitioned by event type and hour."""
+
+import argparse
+import json
+import sys
+import uuid
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+import log_sources
+
+# Import configuration
+sys.path.append(str(Path(__file__).parent.parent / "gcp_utils"))
+from config import (
+    COMMAND_LOG_ARCHIVE_PATTERN,
+    COMMAND_LOG_PATTERN,
+    NETWORK_LOG_DIR,
+    NETWORK_LOG_PATTERN,
+    VERBOSE_LOG_DIR,
+)
+
+# Records written per Parquet batch
+BATCH_SIZE = 200000
+
+# Converted inputs, so re-running only picks up new data
+MANIFEST_NAME = "_manifest.json"
+
+# Manifest entry with the longest flow seen. Flows are partitioned by the hour
+# they started in, so a query has to look this far back to find flows which
+# are still open at its start time.
+MAX_FLOW_SECONDS = "max_flow_seconds"
+
+# One schema for every event type; columns that do not apply stay null
+SCHEMA = pa.schema(
+    [
+        ("ts", pa.timestamp("us", tz="UTC")),
+        ("last_ts", pa.timestamp("us", tz="UTC")),
+        ("pid", pa.int64()),
+        ("comm", pa.string()),
+        ("host", pa.string()),
+        ("user", pa.string()),
+        ("proto", pa.string()),
+        ("src_ip", pa.string()),
+        ("src_port", pa.int32()),
+        ("dst_ip", pa.string()),
+        ("dst_port", pa.int32()),
+        ("bytes", pa.int64()),
+        ("bytes_sent", pa.int64()),
+        ("bytes_recv", pa.int64()),
+        ("packets_sent", pa.int64()),
+        ("packets_recv", pa.int64()),
+        ("message", pa.string()),
+        ("window", pa.string()),
+        ("file", pa.string()),
+        ("evt", pa.string()),
+        ("hour", pa.string()),
+    ]
+)
+PARTITIONING = ds.partitioning(
+    pa.schema([("evt", pa.string()), ("hour", pa.string())]), flavor="hive"
+)
+
+
+def hour_of(seconds):
+    return log_sources.to_datetime(seconds).strftime("%Y-%m-%dT%H")
+
+
+def read_manifest(out_dir):
+    path = Path(out_dir) / MANIFEST_NAME
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def network_records(path, dictionaries):
+    """Yield archive rows for the BPF events and flow records in one log."""
+    for event in log_sources.read_network_log(path, dictionaries):
+        evt = event.get("evt")
+        if evt == "flow":
+            seconds = log_sources.parse_bpf_ts(event["first_ts"])
+            event["last_ts"] = log_sources.to_datetime(log_sources.parse_bpf_ts(event["last_ts"]))
+        elif isinstance(event.get("ts"), str):
+            seconds = log_sources.parse_bpf_ts(event["ts"])
+            event["proto"] = evt.split("_", 1)[0]
+        else:
+            # bpftrace_start carries a monotonic nanosecond counter
+            continue
+        event["ts"] = log_sources.to_datetime(seconds)
+        event["hour"] = hour_of(seconds)
+        event["file"] = path.name
+        yield event
+
+
+class Archive:
+    """Buffers rows and writes them out as Parquet in batches."""
+
+    def __init__(self, out_dir):
+        self.out_dir = Path(out_dir)
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.out_dir / MANIFEST_NAME
+        self.manifest = read_manifest(self.out_dir)
+        self.rows = []
+        self.written = 0
+
+    def add(self, row):
+        if row.get("evt") == "flow":
+            duration = (row["last_ts"] - row["ts"]).total_seconds()
+            if duration > self.manifest.get(MAX_FLOW_SECONDS, 0):
+                self.manifest[MAX_FLOW_SECONDS] = duration
+        self.rows.append(row)
+        if len(self.rows) >= BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        if not self.rows:
+            return
+        table = pa.Table.from_pylist(self.rows, schema=SCHEMA)
+        ds.write_dataset(
+            table,
+            self.out_dir,
+            format="parquet",
+            partitioning=PARTITIONING,
+            basename_template=f"part-{uuid.uuid4().hex}-{{i}}.parquet",
+            existing_data_behavior="overwrite_or_ignore",
+        )
+        self.written += len(self.rows)
+        self.rows = []
+
+    def done(self, source, state):
+        """Flush and remember how far a source file has been converted."""
+        self.flush()
+        self.manifest[str(source)] = state
+        self.manifest_path.write_text(json.dumps(self.manifest, indent=1))
+
+
+def convert_network_logs(archive, directory):
+    directory = Path(directory)
+    if not directory.is_dir():
+        return
+    dictionaries = log_sources.load_dictionaries(directory)
+    for path in sorted(directory.glob(NETWORK_LOG_PATTERN)):
+        # Rotated network logs never change once written
+        if str(path.resolve()) in archive.manifest:
+            continue
+        for row in network_records(path, dictionaries):
+            archive.add(row)
+        archive.done(path.resolve(), True)
+
+
+def convert_events_log(archive, path):
+    path = Path(path)
+    if not path.is_file():
+        return
+    offset = archive.manifest.get(str(path.resolve()), 0)
+    for offset, seconds, marker in log_sources.read_events_log(path, offset):
+        archive.add(
+            {
+                "ts": log_sources.to_datetime(seconds),
+                "evt": "marker",
+                "hour": hour_of(seconds),
+                "message": marker["message"],
+                "host": marker.get("host"),
+                "user": marker.get("user"),
+                "window": marker.get("window"),
+                "file": path.name,
+            }
+        )
+    archive.done(path.resolve(), offset)
+
+
+def convert_command_logs(archive, directory):
+    """Add one row per command log segment with the shell pid, user and size."""
+    directory = Path(directory)
+    if not directory.is_dir():
+        return
+    paths = list(directory.glob(COMMAND_LOG_PATTERN)) + list(directory.glob(COMMAND_LOG_ARCHIVE_PATTERN))
+    for path in sorted(paths):
+        parsed = log_sources.parse_command_log_name(path)
+        if not parsed or str(path.resolve()) in archive.manifest:
+            continue
+        seconds, pid, user = parsed
+        archive.add(
+            {
+                "ts": log_sources.to_datetime(seconds),
+                "evt": "command_log",
+                "hour": hour_of(seconds),
+                "pid": pid,
+                "user": user,
+                "bytes": path.stat().st_size,
+                "file": path.name,
+            }
+        )
+        archive.done(path.resolve(), True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("out", help="Directory to write the Parquet archive to.")
+    parser.add_argument(
+        "--log-dir",
+        default=VERBOSE_LOG_DIR,
+        help=f'Directory with events.log and the command logs. Default: "{VERBOSE_LOG_DIR}"',
+    )
+    parser.add_argument(
+        "--network-log-dir",
+        default=NETWORK_LOG_DIR,
+        help=f'Directory with the BPF network logs. Default: "{NETWORK_LOG_DIR}"',
+    )
+    args = parser.parse_args()
+
+    archive = Archive(args.out)
+    convert_network_logs(archive, args.network_log_dir)
+    convert_events_log(archive, Path(args.log_dir) / "events.log")
+    convert_command_logs(archive, args.log_dir)
+    print(f"Wrote {archive.written} rows to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+#!/usr/bin/env python3
+"""Reconstruct commands from asciinema command logs and search them with SQLite FTS5."""
+
+import argparse
+import gzip
+import json
+import re
+import sqlite3
+import sys
+from pathlib import Path
+
+import log_sources
+
+# Import configuration
+sys.path.append(str(Path(__file__).parent.parent / "gcp_utils"))
+from config import COMMAND_LOG_PATTERN
+
+# CSI escape sequences: ESC [ <parameters> <final byte>
+CSI = re.compile(r"\x1b\[([0-9;?]*)([@-~])")
+# Other escape sequences (charset selection, keypad mode, OSC titles, ...)
+OTHER_ESCAPE = re.compile(r"\x1b(?:\][^\x07\x1b]*(?:\x07|\x1b\\)|[()][0-9A-Za-z]|[=>78])")
+
+ALT_SCREEN = {"?1049", "?1047", "?47"}
+
+
+class LineEmulator:
+    """Tracks the text of the terminal line the cursor is on.
+
+    Only the sequences readline uses to edit a single line are emulated:
+    printing, backspace, carriage return, cursor left/right, erase to end of
+    line and insert/delete characters. That is enough to recover the command
+    line as it was on screen when Enter was pressed, including history
+    recall and tab completion.
+    """
+
+    def __init__(self):
+        self.line = []
+        self.cursor = 0
+        self.alt_screen = False
+
+    def feed(self, data):
+        pos = 0
+        while pos < len(data):
+            char = data[pos]
+            if char == "\x1b":
+                match = CSI.match(data, pos)
+                if match:
+                    self.csi(match.group(1), match.group(2))
+                    pos = match.end()
+                    continue
+                match = OTHER_ESCAPE.match(data, pos)
+                pos = match.end() if match else pos + 1
+                continue
+            if char == "\n":
+                self.line = []
+                self.cursor = 0
+            elif char == "\r":
+                self.cursor = 0
+            elif char == "\b":
+                self.cursor = max(self.cursor - 1, 0)
+            elif char >= " " and char != "\x7f":
+                if self.cursor < len(self.line):
+                    self.line[self.cursor] = char
+                else:
+                    self.line.extend(" " * (self.cursor - len(self.line)))
+                    self.line.append(char)
+                self.cursor += 1
+            pos += 1
+
+    def csi(self, params, final):
+        if final in "hl" and params in ALT_SCREEN:
+            self.alt_screen = final == "h"
+            return
+        count = int(params) if params.isdigit() else 1
+        if final == "D":
+            self.cursor = max(self.cursor - count, 0)
+        elif final == "C":
+            self.cursor += count
+        elif final == "K":
+            if params in ("", "0"):
+                del self.line[self.cursor :]
+            elif params == "2":
+                self.line = []
+        elif final == "P":
+            del self.line[self.cursor : self.cursor + count]
+        elif final == "@":
+            self.line[self.cursor : self.cursor] = [" "] * count
+
+    def text(self):
+        return "".join(self.line)
+
+
+def open_cast(path):
+    path = Path(path)
+    if path.suffix == ".gz":
+        return gzip.open(path, "rt", errors="replace")
+    return open(path, errors="replace")
+
+
+def parse_cast(paths):
+    """Yield (epoch seconds, command) for every command run in a session.
+
+    paths are the segments of one recorded shell in order; they are read one
+    event at a time and the terminal state carries over from one segment to
+    the next. A command is the part of the screen line after the prompt at
+    the moment Enter is pressed, so input that is not echoed (passwords) is
+    never recorded, and keys typed inside full screen programs such as
+    editors are ignored.
+
+    When Enter arrives in the same input event as the rest of the line (a
+    paste or type-ahead), the line has not been echoed yet. The command is
+    then read when the echoed newline is printed, or taken from the input
+    itself if the next key arrives first.
+    """
+    screen = LineEmulator()
+    prompt_len = None
+    line_start = None
+    # (line_start, typed text) of a line whose Enter has not been echoed yet
+    pending = None
+    for path in paths:
+        with open_cast(path) as cast:
+            header = json.loads(cast.readline())
+            started = header.get("timestamp", 0)
+            for raw in cast:
+                try:
+                    offset, kind, data = json.loads(raw)
+                except ValueError:
+                    continue
+                if kind == "o":
+                    if pending is not None and "\n" in data:
+                        head, _, rest = data.partition("\n")
+                        screen.feed(head)
+                        command = screen.text()[prompt_len:].strip()
+                        if command:
+                            yield pending[0], command
+                        pending = None
+                        prompt_len = None
+                        data = "\n" + rest
+                    screen.feed(data)
+                    continue
+                if kind != "i":
+                    continue
+                if pending is not None:
+                    # No echo before the next key: fall back to what was typed
+                    if pending[1]:
+                        yield pending
+                    pending = None
+                    prompt_len = None
+                if screen.alt_screen:
+                    continue
+                if prompt_len is None:
+                    # First key of a new command line: everything already on
+                    # the line is the prompt
+                    prompt_len = screen.cursor
+                    line_start = started + offset
+                if "\r" in data or "\n" in data:
+                    typed = re.split(r"[\r\n]", data, maxsplit=1)[0]
+                    if typed:
+                        typed = "".join(char for char in typed if char >= " " and char != "\x7f")
+                        pending = (line_start, (screen.text()[prompt_len:] + typed).strip())
+                        continue
+                    command = screen.text()[prompt_len:].strip()
+                    if command:
+                        yield line_start, command
+                    prompt_len = None
+                elif data == "\x03":
+                    prompt_len = None
+    if pending is not None and pending[1]:
+        yield pending
+
+
+class CommandIndex:
+    """SQLite store of commands with an FTS5 index over the command text."""
+
+    def __init__(self, path):
+        self.db = sqlite3.connect(path)
+        self.db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS casts (
+                path TEXT PRIMARY KEY,
+                session TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS casts_session ON casts (session);
+            CREATE TABLE IF NOT EXISTS commands (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                host TEXT,
+                user TEXT,
+                shell_pid INTEGER,
+                session TEXT NOT NULL,
+                command TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS commands_session ON commands (session);
+            CREATE VIRTUAL TABLE IF NOT EXISTS commands_fts USING fts5 (
+                command,
+                content='commands',
+                content_rowid='id',
+                tokenize="unicode61 tokenchars '-_.'",
+                prefix='2 3'
+            );
+            CREATE TRIGGER IF NOT EXISTS commands_ai AFTER INSERT ON commands BEGIN
+                INSERT INTO commands_fts (rowid, command) VALUES (new.id, new.command);
+            END;
+            CREATE TRIGGER IF NOT EXISTS commands_ad AFTER DELETE ON commands BEGIN
+                INSERT INTO commands_fts (commands_fts, rowid, command)
+                VALUES ('delete', old.id, old.command);
+            END;
+            """
+        )
+
+    def add_session(self, session, paths, host):
+        """Index the segments of one session unless none changed since the last build.
+
+        paths must be in segment order. Returns the number of commands added.
+        """
+        current = {}
+        for path in paths:
+            stat = path.stat()
+            current[str(path.resolve())] = (stat.st_size, stat.st_mtime)
+        indexed = {
+            path: (size, mtime)
+            for path, size, mtime in self.db.execute(
+                "SELECT path, size, mtime FROM casts WHERE session = ?", (session,)
+            )
+        }
+        if current == indexed:
+            return 0
+        parsed = log_sources.parse_command_log_name(paths[0])
+        _, shell_pid, user = parsed if parsed else (None, None, None)
+        with self.db:
+            self.db.execute("DELETE FROM commands WHERE session = ?", (session,))
+            self.db.execute("DELETE FROM casts WHERE session = ?", (session,))
+            count = 0
+            for ts, command in parse_cast(paths):
+                self.db.execute(
+                    "INSERT INTO commands (ts, host, user, shell_pid, session, command)"
+                    " VALUES (?, ?, ?, ?, ?, ?)",
+                    (ts, host, user, shell_pid, session, command),
+                )
+                count += 1
+            self.db.executemany(
+                "INSERT INTO casts VALUES (?, ?, ?, ?)",
+                [(path, session, size, mtime) for path, (size, mtime) in current.items()],
+            )
+        return count
+
+    def search(self, query, limit):
+        return self.db.execute(
+            "SELECT c.ts, c.host, c.user, c.command FROM commands_fts"
+            " JOIN commands c ON c.id = commands_fts.rowid"
+            " WHERE commands_fts MATCH ? ORDER BY c.ts LIMIT ?",
+            (query, limit),
+        )
+
+
+def group_sessions(casts):
+    """Group cast files by recorded shell, with segments in order.
+
+    Returns {session key: [paths]}; the key includes the directory so equal
+    file names from different participants stay apart.
+    """
+    sessions = {}
+    for path in casts:
+        parsed = log_sources.command_log_session(path)
+        if not parsed:
+            continue
+        name, segment = parsed
+        key = str(path.parent.resolve() / name)
+        sessions.setdefault(key, []).append((segment, path))
+    return {key: [path for _, path in sorted(segments)] for key, segments in sessions.items()}
+
+
+def host_of(path):
+    """Guess the participant host from the <host>/command-logs/ upload layout."""
+    if path.parent.name == "command-logs":
+        return path.parent.parent.name
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("db", help="SQLite database to store the index in.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Index command logs.")
+    build_parser.add_argument(
+        "paths",
+        nargs="+",
+        help="Command logs or directories to search for them recursively.",
+    )
+    build_parser.add_argument("--host", help="Host name to record instead of guessing it.")
+    search_parser = subparsers.add_parser("search", help="Search indexed commands.")
+    search_parser.add_argument("query", help='FTS5 query, e.g. "nmap OR crackmapexec"')
+    search_parser.add_argument("--limit", type=int, default=1000, help="Default: 1000")
+    args = parser.parse_args()
+
+    index = CommandIndex(args.db)
+    if args.command == "build":
+        casts = []
+        for name in args.paths:
+            path = Path(name)
+            casts += [path] if path.is_file() else path.rglob(COMMAND_LOG_PATTERN + "*")
+        total = 0
+        for session, paths in group_sessions(casts).items():
+            total += index.add_session(session, paths, args.host or host_of(paths[0]))
+        print(f"Indexed {total} commands")
+        return
+
+    for ts, host, user, command in index.search(args.query, args.limit):
+        when = log_sources.to_datetime(ts).isoformat(timespec="seconds")
+        print(f"{when}\t{host or ''}\t{user or ''}\t{command}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+"""Readers for the log files collected from participant VMs."""
+
+import calendar
+import io
+import json
+import re
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import zstandard as zstd
+
+# Import configuration
+sys.path.append(str(Path(__file__).parent.parent / "gcp_utils"))
+from config import NETWORK_DICT_PATTERN
+
+# Fields of a JSON events.log line kept besides the message
+MARKER_FIELDS = ("host", "user", "mono", "window")
+
+# events.log lines written by the older plain text `log` command
+EVENTS_LOG_LINE = re.compile(r'^(?P<ts>\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\s+"(?P<message>.*)"$')
+
+# command-logs-<YYYYmmdd-HHMMSS>-<shell pid>-<user>[-part<NNNN>].log[.gz]
+COMMAND_LOG_NAME = re.compile(
+    r"^(?P<session>command-logs-(?P<ts>\d{8}-\d{6})-(?P<pid>\d+)-(?P<user>.+?))"
+    r"(?:-part(?P<segment>\d+))?\.log(?:\.gz)?$"
+)
+
+# <tracker>-<YYYY-mm-dd_HH-MM-SS>.jsonl.zst, the tracker name can contain "-"
+NETWORK_LOG_NAME = re.compile(r"^(?P<tracker>.+)-(?P<ts>\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.jsonl\.zst$")
+
+# screen_recording_<YYYY-mm-dd_HH-MM-SS>.mp4
+RECORDING_NAME = re.compile(r"^screen_recording_(?P<ts>\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})\.mp4$")
+
+
+def parse_bpf_ts(ts):
+    """Convert a bpftrace timestamp like 2024-01-01T00:00:00.123456Z to epoch seconds."""
+    base = calendar.timegm(time.strptime(ts[:19], "%Y-%m-%dT%H:%M:%S"))
+    fraction = ts[19:].rstrip("Z")
+    return base + (float(fraction) if fraction else 0)
+
+
+def parse_events_ts(ts):
+    """Convert an events.log timestamp like 2024-01-01_00-00-00 to epoch seconds.
+
+    The participant VMs run in UTC, so the local time written by `date` is
+    treated as UTC.
+    """
+    return calendar.timegm(time.strptime(ts, "%Y-%m-%d_%H-%M-%S"))
+
+
+def parse_any_ts(value):
+    """Convert a timestamp from any of the log sources to epoch seconds.
+
+    Accepts epoch seconds (asciinema), bpftrace/ISO 8601 times and events.log
+    times. ISO times without a zone are taken as UTC.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    if re.match(r"^\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2}$", value):
+        return parse_events_ts(value)
+    parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+def parse_recording_name(path):
+    """Return the start time encoded in a screen recording file name."""
+    match = RECORDING_NAME.match(Path(path).name)
+    if not match:
+        return None
+    return parse_events_ts(match["ts"])
+
+
+def to_datetime(seconds):
+    return datetime.fromtimestamp(seconds, tz=timezone.utc)
+
+
+def load_dictionaries(directory):
+    """Return the zstd dictionaries next to the network logs keyed by dict ID."""
+    dictionaries = {}
+    for path in Path(directory).glob(NETWORK_DICT_PATTERN):
+        dictionary = zstd.ZstdCompressionDict(path.read_bytes())
+        dictionaries[dictionary.dict_id()] = dictionary
+    return dictionaries
+
+
+def open_network_log(path, dictionaries=None):
+    """Open a network log as a binary stream, decompressing .zst files.
+
+    dictionaries maps dict IDs to zstd dictionaries and is loaded from the
+    file's directory when not given.
+    """
+    path = Path(path)
+    if path.suffix != ".zst":
+        return open(path, "rb")
+    if dictionaries is None:
+        dictionaries = load_dictionaries(path.parent)
+    with open(path, "rb") as file:
+        dict_id = zstd.get_frame_parameters(file.read(18)).dict_id
+    dictionary = dictionaries.get(dict_id) if dict_id else None
+    if dict_id and dictionary is None:
+        raise ValueError(f"{path}: zstd dictionary {dict_id} not found")
+    decompressor = zstd.ZstdDecompressor(dict_data=dictionary)
+    return io.BufferedReader(decompressor.stream_reader(open(path, "rb"), closefd=True))
+
+
+def read_network_log(path, dictionaries=None):
+    """Yield the JSON events of a bpftrace or flow log one at a time."""
+    with open_network_log(path, dictionaries) as stream:
+        for line in stream:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
+
+
+def read_events_log(path, offset=0):
+    """Yield (end offset, epoch seconds, marker) for each marker in events.log.
+
+    marker is a dict with the "message" and, for JSON lines written by the
+    current `log` command, "host", "user", "mono" and "window" when present.
+    Lines from the older plain text format are still understood. Reading
+    starts at byte offset so a growing file can be processed incrementally.
+    """
+    with open(path, "rb") as file:
+        file.seek(offset)
+        for raw in file:
+            offset += len(raw)
+            line = raw.decode(errors="replace").strip()
+            if line.startswith("{"):
+                try:
+                    record = json.loads(line)
+                    seconds = parse_bpf_ts(record["ts"])
+                except (ValueError, KeyError):
+                    continue
+                marker = {key: record[key] for key in MARKER_FIELDS if key in record}
+                marker["message"] = record.get("msg", "")
+                yield offset, seconds, marker
+                continue
+            match = EVENTS_LOG_LINE.match(line)
+            if match:
+                yield offset, parse_events_ts(match["ts"]), {"message": match["message"]}
+
+
+def parse_command_log_name(path):
+    """Return (epoch seconds, shell pid, user) encoded in a command log file name."""
+    match = COMMAND_LOG_NAME.match(Path(path).name)
+    if not match:
+        return None
+    seconds = calendar.timegm(time.strptime(match["ts"], "%Y%m%d-%H%M%S"))
+    return seconds, int(match["pid"]), match["user"]
+
+
+def command_log_session(path):
+    """Return (session name, segment number) for a command log.
+
+    Casts written before rotation was added are a single segment 0.
+    """
+    match = COMMAND_LOG_NAME.match(Path(path).name)
+    if not match:
+        return None
+    return match["session"], int(match["segment"] or 0)
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Query the Parquet archive written by archive.py."""
+
+import argparse
+import csv
+import sys
+from datetime import datetime, timedelta, timezone
+
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+
+from archive import MAX_FLOW_SECONDS, PARTITIONING, read_manifest
+
+# Columns printed when --columns is not given
+DEFAULT_COLUMNS = ["ts", "evt", "pid", "comm", "src_ip", "src_port", "dst_ip", "dst_port", "bytes"]
+
+
+def parse_time(value):
+    """Parse an ISO 8601 time; times without a zone are taken as UTC."""
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def build_filter(args, max_flow_seconds=0):
+    """Turn the command line options into a dataset filter expression.
+
+    Events match if they overlap the time range: flows from first_ts to
+    last_ts, everything else at ts. Time bounds also restrict the hour
+    partition column, so files outside the range are skipped without being
+    opened. Flows are partitioned by the hour they started in, so for them
+    the start bound reaches back by the longest flow in the archive.
+    """
+    conditions = []
+    if args.start:
+        conditions.append(pc.coalesce(pc.field("last_ts"), pc.field("ts")) >= args.start)
+        flow_start = args.start - timedelta(seconds=max_flow_seconds)
+        conditions.append(
+            ((pc.field("evt") != "flow") & (pc.field("hour") >= args.start.strftime("%Y-%m-%dT%H")))
+            | ((pc.field("evt") == "flow") & (pc.field("hour") >= flow_start.strftime("%Y-%m-%dT%H")))
+        )
+    if args.end:
+        conditions.append(pc.field("ts") < args.end)
+        conditions.append(pc.field("hour") <= args.end.strftime("%Y-%m-%dT%H"))
+    if args.evt:
+        conditions.append(pc.field("evt").isin(args.evt))
+    if args.pid is not None:
+        conditions.append(pc.field("pid") == args.pid)
+    if args.comm:
+        conditions.append(pc.field("comm") == args.comm)
+    if args.dst_ip:
+        conditions.append(pc.field("dst_ip") == args.dst_ip)
+    if args.dst_port is not None:
+        conditions.append(pc.field("dst_port") == args.dst_port)
+    if not conditions:
+        return None
+    expression = conditions[0]
+    for condition in conditions[1:]:
+        expression = expression & condition
+    return expression
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("archive", help="Directory written by archive.py.")
+    parser.add_argument("--start", type=parse_time, help="Earliest time, e.g. 2024-01-01T14:00")
+    parser.add_argument("--end", type=parse_time, help="Time to stop before, e.g. 2024-01-01T14:30")
+    parser.add_argument(
+        "--evt",
+        action="append",
+        help="Event type, e.g. flow, tcp_connect or marker. Can be repeated.",
+    )
+    parser.add_argument("--pid", type=int)
+    parser.add_argument("--comm")
+    parser.add_argument("--dst-ip")
+    parser.add_argument("--dst-port", type=int)
+    parser.add_argument(
+        "--columns",
+        default=",".join(DEFAULT_COLUMNS),
+        help="Comma separated columns to print.",
+    )
+    args = parser.parse_args()
+
+    dataset = ds.dataset(args.archive, format="parquet", partitioning=PARTITIONING)
+    columns = args.columns.split(",")
+    max_flow_seconds = read_manifest(args.archive).get(MAX_FLOW_SECONDS, 0)
+    scanner = dataset.scanner(columns=columns, filter=build_filter(args, max_flow_seconds))
+
+    writer = csv.writer(sys.stdout, dialect="unix")
+    writer.writerow(columns)
+    for batch in scanner.to_batches():
+        for row in zip(*(batch.column(name).to_pylist() for name in columns)):
+            writer.writerow(row)
+
+
+if __name__ == "__main__":
+    main()
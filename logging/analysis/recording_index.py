@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+"""Map wall-clock times to positions in the screen recordings and cut clips."""
+
+import argparse
+import bisect
+import json
+import subprocess  # nosec B404
+import sys
+import tempfile
+from pathlib import Path
+
+import log_sources
+
+# Import configuration
+sys.path.append(str(Path(__file__).parent.parent / "gcp_utils"))
+from config import SCREEN_RECORD_LOG_DIR, SCREEN_RECORD_PATTERN
+
+INDEX_NAME = ".recording_index.json"
+
+
+def probe_duration(path):
+    """Return the duration of a recording in seconds using ffprobe."""
+    result = subprocess.run(
+        [
+            "ffprobe",
+            "-v",
+            "error",
+            "-show_entries",
+            "format=duration",
+            "-of",
+            "default=noprint_wrappers=1:nokey=1",
+            str(path),
+        ],
+        capture_output=True,
+        text=True,
+        check=False,
+    )  # nosec B603 B607
+    try:
+        return float(result.stdout.strip())
+    except ValueError:
+        return None
+
+
+class RecordingIndex:
+    """Sorted (start, duration, file) entries for a recordings directory.
+
+    Entries are cached in INDEX_NAME inside the directory together with each
+    file's size and mtime, so ffprobe only runs for new or changed files.
+    """
+
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.path = self.directory / INDEX_NAME
+        cached = json.loads(self.path.read_text()) if self.path.exists() else {}
+        self.files = cached.get("files", {})
+        self.sort()
+
+    def sort(self):
+        self.entries = sorted(
+            (entry["start"], entry["duration"], name) for name, entry in self.files.items()
+        )
+        self.starts = [start for start, _, _ in self.entries]
+
+    def update(self):
+        """Probe new or changed recordings and drop deleted ones from the index."""
+        seen = set()
+        changed = False
+        for path in self.directory.glob(SCREEN_RECORD_PATTERN):
+            start = log_sources.parse_recording_name(path)
+            if start is None:
+                continue
+            seen.add(path.name)
+            stat = path.stat()
+            entry = self.files.get(path.name)
+            if entry and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                continue
+            duration = probe_duration(path)
+            if duration is None:
+                continue
+            self.files[path.name] = {
+                "start": start,
+                "duration": duration,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime,
+            }
+            changed = True
+        for name in set(self.files) - seen:
+            del self.files[name]
+            changed = True
+        if changed:
+            self.path.write_text(json.dumps({"files": self.files}))
+            self.sort()
+
+    def lookup(self, seconds):
+        """Return (file, offset) for a time, or None if nothing was recording."""
+        i = bisect.bisect_right(self.starts, seconds) - 1
+        if i < 0:
+            return None
+        start, duration, name = self.entries[i]
+        if seconds >= start + duration:
+            return None
+        return self.directory / name, seconds - start
+
+    def spans(self, begin, end):
+        """Return (file, inpoint, outpoint) for every recording overlapping [begin, end)."""
+        i = max(bisect.bisect_right(self.starts, begin) - 1, 0)
+        spans = []
+        for start, duration, name in self.entries[i:]:
+            if start >= end:
+                break
+            if start + duration <= begin:
+                continue
+            inpoint = max(begin - start, 0)
+            outpoint = min(end - start, duration)
+            spans.append((self.directory / name, inpoint, outpoint))
+        return spans
+
+
+def cut_clip_exact(spans, out):
+    """Join the given recording spans into one file, re-encoding the video.
+
+    Each input is seeked and decoded from the preceding keyframe, so the
+    clip starts exactly at the requested time.
+    """
+    command = ["ffmpeg", "-loglevel", "error", "-y"]
+    for path, inpoint, outpoint in spans:
+        command += ["-ss", f"{inpoint:.3f}", "-t", f"{outpoint - inpoint:.3f}", "-i", str(path)]
+    inputs = "".join(f"[{i}:v]" for i in range(len(spans)))
+    command += [
+        "-filter_complex",
+        f"{inputs}concat=n={len(spans)}:v=1:a=0[v]",
+        "-map",
+        "[v]",
+        "-c:v",
+        "libx264",
+        "-preset",
+        "veryfast",
+        "-crf",
+        "23",
+        "-pix_fmt",
+        "yuv420p",
+        str(out),
+    ]
+    result = subprocess.run(command, check=False)  # nosec B603 B607
+    return result.returncode == 0
+
+
+def cut_clip(spans, out, exact=False):
+    """Join the given recording spans into one file.
+
+    Without exact, the video is copied without re-encoding. A stream copy can
+    only start at a keyframe, so the clip then begins at the keyframe before
+    the requested time, which can be several seconds earlier (one keyframe
+    interval, longer for idle screens recorded with mpdecimate).
+    """
+    if exact:
+        return cut_clip_exact(spans, out)
+    with tempfile.NamedTemporaryFile("w", suffix=".txt") as concat_list:
+        for path, inpoint, outpoint in spans:
+            concat_list.write(f"file '{path.resolve()}'\ninpoint {inpoint:.3f}\noutpoint {outpoint:.3f}\n")
+        concat_list.flush()
+        result = subprocess.run(
+            [
+                "ffmpeg",
+                "-loglevel",
+                "error",
+                "-y",
+                "-f",
+                "concat",
+                "-safe",
+                "0",
+                "-i",
+                concat_list.name,
+                "-c",
+                "copy",
+                str(out),
+            ],
+            check=False,
+        )  # nosec B603 B607
+    return result.returncode == 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--recordings",
+        default=SCREEN_RECORD_LOG_DIR,
+        help=f'Directory with the recordings. Default: "{SCREEN_RECORD_LOG_DIR}"',
+    )
+    parser.add_argument(
+        "--update",
+        action="store_true",
+        help="Update the index for new recordings before a lookup or clip.",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("build", help="Update the index for new recordings.")
+    lookup_parser = subparsers.add_parser("lookup", help="Print the recording and offset for a time.")
+    lookup_parser.add_argument(
+        "time",
+        help="Epoch seconds, an ISO 8601/bpftrace time, or an events.log time.",
+    )
+    clip_parser = subparsers.add_parser("clip", help="Cut the recording around a time.")
+    clip_parser.add_argument("time", help="Same formats as for lookup.")
+    clip_parser.add_argument("out", help="File to write the clip to.")
+    clip_parser.add_argument("--before", type=float, default=10, help="Seconds before. Default: 10")
+    clip_parser.add_argument("--after", type=float, default=30, help="Seconds after. Default: 30")
+    clip_parser.add_argument(
+        "--exact",
+        action="store_true",
+        help="Re-encode so the clip starts exactly at the time instead of at the keyframe before it.",
+    )
+    args = parser.parse_args()
+
+    # Lookups use the cached index as is, only build and --update look at
+    # the recordings directory
+    index = RecordingIndex(args.recordings)
+    if args.command == "build" or args.update:
+        index.update()
+    if args.command == "build":
+        print(f"Indexed {len(index.entries)} recordings")
+        return
+    if not index.entries:
+        print(f'No recordings indexed in "{args.recordings}", run "build" first', file=sys.stderr)
+        sys.exit(1)
+
+    seconds = log_sources.parse_any_ts(args.time)
+    if args.command == "lookup":
+        found = index.lookup(seconds)
+        if not found:
+            print("No recording covers that time", file=sys.stderr)
+            sys.exit(1)
+        path, offset = found
+        print(f"{path}\t{offset:.3f}")
+        return
+
+    spans = index.spans(seconds - args.before, seconds + args.after)
+    if not spans:
+        print("No recording covers that time", file=sys.stderr)
+        sys.exit(1)
+    if not cut_clip(spans, args.out, args.exact):
+        print("ffmpeg failed to cut the clip", file=sys.stderr)
+        sys.exit(1)
+    print(f"Wrote {args.out} from {len(spans)} recording(s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+"""Merge all participant log sources into one chronological timeline."""
+
+import argparse
+import heapq
+import itertools
+import json
+import sys
+from pathlib import Path
+
+import command_index
+import log_sources
+from recording_index import RecordingIndex
+
+# Import configuration
+sys.path.append(str(Path(__file__).parent.parent / "gcp_utils"))
+from config import (
+    COMMAND_LOG_ARCHIVE_PATTERN,
+    COMMAND_LOG_PATTERN,
+    FLOW_IDLE_TIMEOUT,
+    NETWORK_LOG_DIR,
+    NETWORK_LOG_PATTERN,
+    SCREEN_RECORD_LOG_DIR,
+    VERBOSE_LOG_DIR,
+)
+
+# bpftrace output is only nearly sorted (per-CPU buffers), and bpf-flows
+# writes a flow up to FLOW_IDLE_TIMEOUT after its last_ts. Idle flows are
+# swept every second, also while no events arrive, and a full table evicts the
+# least recently active flow, so no flow is written later than that. Network events are
+# re-sorted within the idle timeout plus some slack.
+REORDER_WINDOW = FLOW_IDLE_TIMEOUT + 30
+
+
+def reorder(entries, window):
+    """Sort a nearly sorted stream of (seconds, record) using a bounded buffer.
+
+    Entries are held back until one at least window seconds newer has been
+    seen, so memory depends on the event rate, not the stream length.
+    """
+    buffer = []
+    counter = itertools.count()
+    for seconds, record in entries:
+        heapq.heappush(buffer, (seconds, next(counter), record))
+        while buffer[0][0] < seconds - window:
+            popped_seconds, _, popped = heapq.heappop(buffer)
+            yield popped_seconds, popped
+    while buffer:
+        popped_seconds, _, popped = heapq.heappop(buffer)
+        yield popped_seconds, popped
+
+
+def marker_entries(path):
+    for _, seconds, marker in log_sources.read_events_log(path):
+        marker["source"] = "marker"
+        yield seconds, marker
+
+
+def network_entries(paths):
+    """Events from the rotated network logs of one tracker, oldest file first."""
+    dictionaries = {}
+    for path in paths:
+        if not dictionaries:
+            dictionaries = log_sources.load_dictionaries(path.parent)
+        for event in log_sources.read_network_log(path, dictionaries):
+            if event.get("evt") == "flow":
+                # Flows are written when they end
+                seconds = log_sources.parse_bpf_ts(event["last_ts"])
+            elif isinstance(event.get("ts"), str):
+                seconds = log_sources.parse_bpf_ts(event["ts"])
+            else:
+                continue
+            event["source"] = "network"
+            yield seconds, event
+
+
+def command_entries(session, paths):
+    for seconds, command in command_index.parse_cast(paths):
+        yield seconds, {"source": "command", "session": Path(session).name, "command": command}
+
+
+def recording_entries(directory):
+    index = RecordingIndex(directory)
+    index.update()
+    for start, duration, name in index.entries:
+        yield start, {"source": "recording", "file": name, "duration": duration}
+
+
+def collect_sources(args):
+    """Return one time-sorted iterator per log stream."""
+    sources = []
+    log_dir = Path(args.log_dir)
+    if (log_dir / "events.log").is_file():
+        sources.append(marker_entries(log_dir / "events.log"))
+
+    if log_dir.is_dir():
+        casts = list(log_dir.glob(COMMAND_LOG_PATTERN)) + list(log_dir.glob(COMMAND_LOG_ARCHIVE_PATTERN))
+        for session, paths in command_index.group_sessions(casts).items():
+            sources.append(command_entries(session, paths))
+
+    network_dir = Path(args.network_log_dir)
+    if network_dir.is_dir():
+        # Rotated files are named <tracker>-<timestamp>, so sorting by name
+        # puts each tracker's files in order
+        trackers = {}
+        for path in sorted(network_dir.glob(NETWORK_LOG_PATTERN)):
+            match = log_sources.NETWORK_LOG_NAME.match(path.name)
+            tracker = match["tracker"] if match else path.name
+            trackers.setdefault(tracker, []).append(path)
+        for paths in trackers.values():
+            sources.append(reorder(network_entries(paths), REORDER_WINDOW))
+
+    if args.recordings and Path(args.recordings).is_dir():
+        sources.append(recording_entries(args.recordings))
+    return sources
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("out", help='JSON lines file to write the timeline to, "-" for stdout.')
+    parser.add_argument(
+        "--log-dir",
+        default=VERBOSE_LOG_DIR,
+        help=f'Directory with events.log and the command logs. Default: "{VERBOSE_LOG_DIR}"',
+    )
+    parser.add_argument(
+        "--network-log-dir",
+        default=NETWORK_LOG_DIR,
+        help=f'Directory with the BPF network logs. Default: "{NETWORK_LOG_DIR}"',
+    )
+    parser.add_argument(
+        "--recordings",
+        help=f'Directory with the screen recordings, e.g. "{SCREEN_RECORD_LOG_DIR}".',
+    )
+    args = parser.parse_args()
+
+    out = sys.stdout if args.out == "-" else open(args.out, "w")
+    count = 0
+    # heapq.merge only holds the head of each source in memory
+    for seconds, record in heapq.merge(*collect_sources(args), key=lambda entry: entry[0]):
+        record["ts"] = log_sources.to_datetime(seconds).isoformat(timespec="microseconds")
+        out.write(json.dumps(record) + "\n")
+        count += 1
+    if out is not sys.stdout:
+        out.close()
+        print(f"Wrote {count} events to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
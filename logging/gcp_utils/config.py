@@ -6,12 +6,33 @@ SCREEN_RECORD_LOG_DIR = "logs/recordings"
 SCREEN_RECORD_PROGRESS_DIR = "logs/in_progress"
 VERBOSE_LOG_DIR = "logs"
 WINDOW_LOG_FILE = "logs/window_info.log"
+SCREEN_RECORD_STATS_FILE = "logs/screen-record-stats.log"
+SCREEN_RECORD_METRICS_FILE = "logs/screen-record-metrics.log"
 COMMAND_LOG_DIR = "logs"
+NETWORK_LOG_DIR = "network-logs"
+
+
+# === Cloud storage ===
+BUCKET_NAME = ""
+STORAGE_ENDPOINT = "https://storage.googleapis.com"
+SCOPES = ["https://www.googleapis.com/auth/devstorage.read_write"]
+
+# === Uploads ===
+UPLOAD_LEDGER_FILE = "logs/uploads.sqlite3"
+UPLOAD_WORKERS = 2
+UPLOAD_CHUNK_SIZE = 8 * 1024 * 1024  # bytes, rounded down to a multiple of 256 KiB
+# Upload bandwidth cap shared by all workers, so uploads never saturate the
+# participant's uplink. 0 disables the cap.
+UPLOAD_RATE_LIMIT = 1024 * 1024  # bytes per second
+UPLOAD_BURST = 256 * 1024  # bytes
 
 
 # === File patterns ===
 SCREEN_RECORD_PATTERN = "*.mp4"
 COMMAND_LOG_PATTERN = "command-logs-*.log"
+COMMAND_LOG_ARCHIVE_PATTERN = "command-logs-*.log.gz"
+NETWORK_LOG_PATTERN = "*.jsonl.zst"
+NETWORK_DICT_PATTERN = "*.dict"
 
 # === Log tags? ===
 LOG_TAG = "Uploader"
@@ -19,8 +40,79 @@ LOG_TAG = "Uploader"
 # === Timing ===
 DISPLAY_DETECTION_MAX_ATTEMPTS = 15
 DISPLAY_DETECTION_SLEEP_TIME = 2
-WINDOW_LOG_SLEEP_TIME = 2
+WINDOW_LOG_DEBOUNCE = 0.5  # seconds focus must be stable before it is logged
 SCREEN_RECORD_DURATION = 60  # seconds
+SEGMENT_WATCH_SLEEP_TIME = 5  # seconds between checks for finished segments
+UPLOAD_SCAN_SLEEP_TIME = 10  # seconds between scans for new files
+UPLOAD_SETTLE_TIME = 30  # seconds a file must be unmodified before upload
+
+# === Screen recording ===
+# "segment": one long-lived ffmpeg cutting files with the segment muxer
+# "restart": restart ffmpeg for every SCREEN_RECORD_DURATION clip
+SCREEN_RECORD_MODE = "segment"
+
+# Capture profiles, from most to least expensive. "decimate" drops frames that
+# do not change (mpdecimate) and writes variable frame rate output, so static
+# screens cost close to nothing. CPU time and bytes per recording are written
+# to SCREEN_RECORD_STATS_FILE for comparing profiles.
+SCREEN_RECORD_PROFILES = {
+    "high": {
+        "framerate": 30,
+        "codec": "libx264",
+        "preset": "ultrafast",
+        "crf": 23,
+        "decimate": False,
+    },
+    "balanced": {
+        "framerate": 15,
+        "codec": "libx264",
+        "preset": "superfast",
+        "crf": 28,
+        "decimate": True,
+    },
+    "low": {
+        "framerate": 5,
+        "codec": "libx264",
+        "preset": "ultrafast",
+        "crf": 32,
+        "decimate": True,
+    },
+}
+SCREEN_RECORD_PROFILE = "balanced"
+
+# === Recording resource budget ===
+# Exceeding a limit steps down to a cheaper profile, or pauses recording once
+# the cheapest profile is in use. Low disk space always pauses.
+RECORD_MONITOR_SLEEP_TIME = 5  # seconds between samples
+RECORD_MAX_CPU_PERCENT = 25  # ffmpeg share of all CPUs
+RECORD_MAX_RSS_MB = 512
+RECORD_MIN_FREE_DISK_MB = 2048
+# Step back up after this many samples in a row below ratio * every limit
+RECORD_RECOVER_RATIO = 0.5
+RECORD_RECOVER_SAMPLES = 12
+# Stepping down again before a step up has lasted as long as the wait for it
+# doubles the wait, up to this many samples (1 hour)
+RECORD_MAX_RECOVER_SAMPLES = 720
+
+# === Network log compression ===
+NETWORK_LOG_QUEUE_SIZE = 100000  # lines buffered before new lines are dropped
+NETWORK_LOG_ZSTD_LEVEL = 3
+NETWORK_LOG_DICT_SIZE = 112640  # bytes
+NETWORK_LOG_DICT_SAMPLES = 20000  # lines used to train the dictionary
+NETWORK_LOG_DICT_SECONDS = 300  # train on fewer lines if they take longer
+NETWORK_LOG_ROTATE_BYTES = 256 * 1024 * 1024  # uncompressed bytes per file
+NETWORK_LOG_ROTATE_SECONDS = 3600
+NETWORK_LOG_STATS_INTERVAL = 60  # seconds
+
+# === Network flow aggregation ===
+FLOW_IDLE_TIMEOUT = 120  # seconds without events before a flow is written
+FLOW_TABLE_MAX = 65536  # open flows kept before the least recent is written
+FLOW_RAW_SAMPLE = 0  # keep every Nth raw traffic event, 0 keeps none
+
+# === Command log rotation ===
+# A new cast segment is started once the current one reaches either limit
+COMMAND_LOG_ROTATE_BYTES = 16 * 1024 * 1024
+COMMAND_LOG_ROTATE_SECONDS = 3600
 
 # === Permissions ===
 LOG_DIR_PERMISSIONS = 0o777
@@ -0,0 +1,32 @@
+import os
+import time
+
+from Xlib import display as xdisplay
+
+from config import DISPLAY_DETECTION_MAX_ATTEMPTS, DISPLAY_DETECTION_SLEEP_TIME
+
+X11_SOCKET_DIR = "/tmp/.X11-unix"
+
+
+def list_displays():
+    """Return the display numbers with a socket in X11_SOCKET_DIR, newest last."""
+    try:
+        names = os.listdir(X11_SOCKET_DIR)
+    except OSError:
+        return []
+    return sorted(int(name[1:]) for name in names if name[1:].isdigit() and name[0] == "X")
+
+
+def connect_display():
+    """Connect to the most recent X display that accepts a connection.
+
+    Returns the display name and its open Xlib connection, or (None, None).
+    """
+    for _ in range(DISPLAY_DETECTION_MAX_ATTEMPTS):
+        for number in reversed(list_displays()):
+            try:
+                return f":{number}", xdisplay.Display(f":{number}")
+            except Exception:
+                continue
+        time.sleep(DISPLAY_DETECTION_SLEEP_TIME)
+    return None, None
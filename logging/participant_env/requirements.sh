@@ -1,6 +1,7 @@
 #!/bin/bash
 sudo apt update && sudo apt install -y wmctrl xdotool ffmpeg x11-utils x11-xserver-utils systemd \
-	bpftrace git jq asciinema
+	bpftrace git jq asciinema python3-xlib \
+	python3-requests python3-google-auth python3-zstandard
 
 KERNEL_VERSION="$(uname -r)"
 sudo apt install "linux-headers-${KERNEL_VERSION}"
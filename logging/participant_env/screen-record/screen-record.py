@@ -1,22 +1,40 @@
 #!/usr/bin/env python3
 
+import json
 import os
+import resource
+import shutil
 import signal
 import subprocess  # nosec B404
 import sys
+import threading
 import time
 from pathlib import Path
 
+from Xlib.ext import randr
+
 # Import configuration
 sys.path.append(str(Path(__file__).parent.parent.parent / "gcp_utils"))
 from config import (
-    DISPLAY_DETECTION_MAX_ATTEMPTS,
-    DISPLAY_DETECTION_SLEEP_TIME,
     LOG_DIR_PERMISSIONS,
+    RECORD_MAX_CPU_PERCENT,
+    RECORD_MAX_RECOVER_SAMPLES,
+    RECORD_MAX_RSS_MB,
+    RECORD_MIN_FREE_DISK_MB,
+    RECORD_MONITOR_SLEEP_TIME,
+    RECORD_RECOVER_RATIO,
+    RECORD_RECOVER_SAMPLES,
     SCREEN_RECORD_DURATION,
     SCREEN_RECORD_LOG_DIR,
+    SCREEN_RECORD_METRICS_FILE,
+    SCREEN_RECORD_MODE,
+    SCREEN_RECORD_PROFILE,
+    SCREEN_RECORD_PROFILES,
     SCREEN_RECORD_PROGRESS_DIR,
+    SCREEN_RECORD_STATS_FILE,
+    SEGMENT_WATCH_SLEEP_TIME,
 )
+from x_display import connect_display
 
 # === Setup paths ===
 OUTPUT_DIR = Path.cwd() / SCREEN_RECORD_LOG_DIR
@@ -37,77 +55,329 @@ else:
         if file.is_file():
             file.rename(OUTPUT_DIR / file.name)
 
-# Try to get the most recent X display
-display = None
-for _ in range(DISPLAY_DETECTION_MAX_ATTEMPTS):
-    try:
-        # Get the most recent X display
-        xorg_result = subprocess.run(
-            ["pgrep", "-a", "Xorg"], capture_output=True, text=True, check=False
-        )  # nosec B603 B607
-        xorg_processes = xorg_result.stdout.strip()
-
-        if not xorg_processes:
-            time.sleep(DISPLAY_DETECTION_SLEEP_TIME)
-            continue
+# === Find the X display ===
+display, x_connection = connect_display()
+if not display:
+    print("ERROR: No valid display found.")
+    sys.exit(1)
+os.environ["DISPLAY"] = display
 
-        # Extract display numbers, sort them, and get the most recent one
-        import re
 
-        display_numbers = re.findall(r":[0-9]*", xorg_processes)
-        if not display_numbers:
-            time.sleep(DISPLAY_DETECTION_SLEEP_TIME)
+def query_resolution():
+    """Ask the X server for the current root window size."""
+    geometry = x_connection.screen().root.get_geometry()
+    return f"{geometry.width}x{geometry.height}"
+
+
+screen_resolution = query_resolution()
+
+
+def watch_resolution():
+    """Refresh the cached resolution when RandR reports a screen change.
+
+    The connection is only used from this thread once recording starts. A
+    running ffmpeg is restarted so x11grab picks up the new size.
+    """
+    global screen_resolution
+    if not x_connection.has_extension("RANDR"):
+        return
+    x_connection.screen().root.xrandr_select_input(randr.RRScreenChangeNotifyMask)
+    while not stop_event.is_set():
+        event = x_connection.next_event()
+        if not isinstance(event, randr.ScreenChangeNotify):
             continue
+        resolution = query_resolution()
+        if resolution != screen_resolution:
+            screen_resolution = resolution
+            restart_requested.set()
+            stop_ffmpeg()
 
-        sorted_displays = sorted(set(display_numbers))
-        display = sorted_displays[-1] if sorted_displays else None
 
-        if display:
-            # Test if display is valid
-            test_result = subprocess.run(
-                ["xdpyinfo", "-display", display], capture_output=True, check=False
-            )  # nosec B603 B607
-            if test_result.returncode == 0:
-                os.environ["DISPLAY"] = display
-                break
+ffmpeg_pid = None
+stop_event = threading.Event()
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+CPU_COUNT = os.cpu_count() or 1
 
-        time.sleep(DISPLAY_DETECTION_SLEEP_TIME)
-    except Exception:
-        time.sleep(DISPLAY_DETECTION_SLEEP_TIME)
-        continue
+# Profiles are ordered from most to least expensive; the configured profile is
+# the ceiling the resource monitor steps back up to
+PROFILE_ORDER = list(SCREEN_RECORD_PROFILES)
+MAX_PROFILE_INDEX = PROFILE_ORDER.index(SCREEN_RECORD_PROFILE)
+profile_index = MAX_PROFILE_INDEX
+active_profile = SCREEN_RECORD_PROFILE
+paused = threading.Event()
+restart_requested = threading.Event()
 
-if not display:
-    print("ERROR: No valid display found.")
-    sys.exit(1)
+# CPU time of the running ffmpeg already accounted for in the stats file, and
+# the RUSAGE_CHILDREN total from before it was started
+last_cpu_seconds = 0.0
+cpu_base = 0.0
+# Serializes flush_segments between the segment watcher and the main thread.
+# Reentrant because the signal handler flushes on the main thread, possibly
+# while it is already inside flush_segments.
+flush_lock = threading.RLock()
 
-# Test display again
-test_result = subprocess.run(
-    ["xdpyinfo", "-display", display], capture_output=True, check=False
-)  # nosec B603 B607
-if test_result.returncode != 0:
-    print(f"ERROR: DISPLAY {display} became invalid. Exiting.")
-    sys.exit(1)
+
+def build_encoder_args(profile):
+    """Build the capture and encoder arguments for a capture profile.
+
+    Returns a (capture_args, encoder_args) pair; capture_args go before the
+    x11grab input and encoder_args after it.
+    """
+    capture_args = ["-framerate", str(profile["framerate"])]
+    encoder_args = [
+        "-c:v",
+        profile["codec"],
+        "-preset",
+        profile["preset"],
+        "-crf",
+        str(profile["crf"]),
+        "-pix_fmt",
+        "yuv420p",
+    ]
+    if profile["decimate"]:
+        # Drop frames that barely differ and keep timestamps variable so an
+        # idle screen encodes almost nothing
+        encoder_args += ["-vf", "mpdecimate", "-vsync", "vfr"]
+    return capture_args, encoder_args
+
+
+def get_process_cpu_seconds(pid):
+    """Return the user + system CPU time of a running process from /proc."""
+    try:
+        with open(f"/proc/{pid}/stat") as stat_file:
+            fields = stat_file.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (OSError, IndexError, ValueError):
+        return None
 
 
-# Get screen resolution
-def get_screen_resolution():
+def get_process_rss_mb(pid):
+    """Return the resident set size of a running process in MiB."""
     try:
-        xdpyinfo_output = subprocess.run(
-            ["xdpyinfo"], capture_output=True, text=True, check=False
-        ).stdout  # nosec B603 B607
-        for line in xdpyinfo_output.split("\n"):
-            if "dimensions" in line:
-                return line.split()[1]
-    except Exception:
+        with open(f"/proc/{pid}/status") as status_file:
+            for line in status_file:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, IndexError, ValueError):
         pass
     return None
 
 
-ffmpeg_pid = None
+def get_children_cpu_seconds():
+    """Return the CPU time used by all reaped child processes."""
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def start_ffmpeg(ffmpeg_cmd, log_file):
+    """Start ffmpeg and reset the per-process CPU accounting."""
+    global ffmpeg_pid, active_profile, last_cpu_seconds, cpu_base
+    with flush_lock:
+        cpu_base = get_children_cpu_seconds()
+        last_cpu_seconds = 0.0
+        active_profile = PROFILE_ORDER[profile_index]
+        process = subprocess.Popen(
+            ffmpeg_cmd, stdout=log_file, stderr=log_file
+        )  # nosec B603
+        ffmpeg_pid = process.pid
+    return process
+
+
+def stop_ffmpeg():
+    """Ask a running ffmpeg to finish its current file and exit."""
+    if ffmpeg_pid:
+        try:
+            os.kill(ffmpeg_pid, signal.SIGINT)
+        except (OSError, ProcessLookupError):
+            pass
+
+
+def write_recording_stats(files, cpu_seconds):
+    """Append one JSON line per recording with its profile, size and CPU cost.
+
+    cpu_seconds covers all files passed in and is split evenly between them.
+    """
+    if not files:
+        return
+    share = cpu_seconds / len(files) if cpu_seconds is not None else None
+    with open(SCREEN_RECORD_STATS_FILE, "a") as stats_file:
+        for file in files:
+            stats_file.write(
+                json.dumps(
+                    {
+                        "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                        "file": file.name,
+                        "profile": active_profile,
+                        "bytes": file.stat().st_size,
+                        "cpu_seconds": round(share, 2) if share is not None else None,
+                    }
+                )
+                + "\n"
+            )
+
+
+def move_completed_segments(include_latest=False):
+    """Move finished recordings from the progress to the output directory.
+
+    The segment muxer names files by start time, so the newest file is the one
+    ffmpeg is still writing to and is left alone unless include_latest is set.
+    Returns the moved files at their new location.
+    """
+    segments = sorted(f for f in PROGRESS_DIR.iterdir() if f.is_file())
+    if not include_latest:
+        segments = segments[:-1]
+    moved = []
+    for file in segments:
+        try:
+            moved.append(file.rename(OUTPUT_DIR / file.name))
+        except OSError:
+            pass
+    return moved
+
+
+def flush_segments(include_latest=False):
+    """Move finished segments and record the CPU used since the last flush.
+
+    Without include_latest, ffmpeg must still be running: once it has exited,
+    the main loop flushes everything with include_latest set.
+    """
+    global last_cpu_seconds
+    with flush_lock:
+        if include_latest:
+            # ffmpeg has exited and been reaped, so its usage is in RUSAGE_CHILDREN
+            cpu_total = get_children_cpu_seconds() - cpu_base
+        else:
+            cpu_total = get_process_cpu_seconds(ffmpeg_pid)
+            if cpu_total is None:
+                return
+        moved = move_completed_segments(include_latest)
+        if not moved:
+            return
+        write_recording_stats(moved, cpu_total - last_cpu_seconds)
+        last_cpu_seconds = cpu_total
+
+
+def watch_segments():
+    """Periodically move completed segments until recording stops."""
+    while not stop_event.wait(SEGMENT_WATCH_SLEEP_TIME):
+        flush_segments()
+
+
+def write_metrics(metrics):
+    """Append one JSON line of resource metrics to SCREEN_RECORD_METRICS_FILE."""
+    with open(SCREEN_RECORD_METRICS_FILE, "a") as metrics_file:
+        metrics_file.write(json.dumps(metrics) + "\n")
+
+
+def monitor_resources():
+    """Sample ffmpeg and disk usage and keep recording within budget.
+
+    Crossing RECORD_MAX_CPU_PERCENT (share of the whole machine) or
+    RECORD_MAX_RSS_MB steps down to the next cheaper profile, or pauses once
+    the cheapest one is in use. Free disk below RECORD_MIN_FREE_DISK_MB always
+    pauses. After recover_samples samples in a row below RECORD_RECOVER_RATIO
+    of every limit, recording resumes or steps back up towards the configured
+    profile.
+
+    A paused ffmpeg uses no CPU, so the budget always looks calm again after a
+    pause. To avoid flapping between recording and pausing (or two profiles),
+    recover_samples starts at RECORD_RECOVER_SAMPLES and doubles, up to
+    RECORD_MAX_RECOVER_SAMPLES, whenever the limits are crossed again before a
+    step up has lasted recover_samples samples. It is reset once one has.
+    """
+    global profile_index
+    last_pid = None
+    last_cpu = None
+    last_sample = None
+    calm_samples = 0
+    recover_samples = RECORD_RECOVER_SAMPLES
+    # Samples since the last resume or step up, None once it has held
+    samples_since_recover = None
+    while not stop_event.wait(RECORD_MONITOR_SLEEP_TIME):
+        now = time.monotonic()
+        pid = ffmpeg_pid if not paused.is_set() else None
+        cpu = get_process_cpu_seconds(pid) if pid else None
+        cpu_percent = None
+        if cpu is not None and pid == last_pid and last_cpu is not None:
+            cpu_percent = (cpu - last_cpu) / (now - last_sample) / CPU_COUNT * 100
+        last_pid, last_cpu, last_sample = pid, cpu, now
+        rss_mb = get_process_rss_mb(pid) if pid else None
+        disk_free_mb = shutil.disk_usage(OUTPUT_DIR).free / (1024 * 1024)
+
+        cpu_ratio = (cpu_percent or 0) / RECORD_MAX_CPU_PERCENT
+        rss_ratio = (rss_mb or 0) / RECORD_MAX_RSS_MB
+        disk_low = disk_free_mb < RECORD_MIN_FREE_DISK_MB
+
+        action = None
+        if samples_since_recover is not None and not paused.is_set():
+            samples_since_recover += 1
+            if samples_since_recover >= recover_samples:
+                samples_since_recover = None
+                recover_samples = RECORD_RECOVER_SAMPLES
+        if disk_low:
+            calm_samples = 0
+            if not paused.is_set():
+                action = "pause"
+        elif cpu_ratio > 1 or rss_ratio > 1:
+            calm_samples = 0
+            if samples_since_recover is not None:
+                samples_since_recover = None
+                recover_samples = min(recover_samples * 2, RECORD_MAX_RECOVER_SAMPLES)
+            if profile_index < len(PROFILE_ORDER) - 1:
+                profile_index += 1
+                action = "step_down"
+            elif not paused.is_set():
+                action = "pause"
+        elif (
+            max(cpu_ratio, rss_ratio) < RECORD_RECOVER_RATIO
+            and disk_free_mb > RECORD_MIN_FREE_DISK_MB / RECORD_RECOVER_RATIO
+        ):
+            calm_samples += 1
+            if calm_samples >= recover_samples:
+                calm_samples = 0
+                if paused.is_set():
+                    action = "resume"
+                elif profile_index > MAX_PROFILE_INDEX:
+                    profile_index -= 1
+                    action = "step_up"
+                if action:
+                    samples_since_recover = 0
+        else:
+            calm_samples = 0
+
+        if action == "pause":
+            paused.set()
+            stop_ffmpeg()
+        elif action == "resume":
+            paused.clear()
+        elif action in ("step_down", "step_up"):
+            # Encoder settings are fixed for the lifetime of an ffmpeg process
+            restart_requested.set()
+            stop_ffmpeg()
+
+        write_metrics(
+            {
+                "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "pid": pid,
+                "profile": PROFILE_ORDER[profile_index],
+                "paused": paused.is_set(),
+                "cpu_percent": round(cpu_percent, 1) if cpu_percent is not None else None,
+                "rss_mb": round(rss_mb, 1) if rss_mb is not None else None,
+                "disk_free_mb": round(disk_free_mb),
+                "recover_samples": recover_samples,
+                "action": action,
+            }
+        )
+
+
+def wait_while_paused():
+    """Block until the resource monitor resumes recording."""
+    while paused.is_set() and not stop_event.is_set():
+        time.sleep(RECORD_MONITOR_SLEEP_TIME)
 
 
 def cleanup(signum, frame):
-    global ffmpeg_pid
+    stop_event.set()
     if ffmpeg_pid:
         try:
             os.kill(ffmpeg_pid, signal.SIGINT)
@@ -115,58 +385,139 @@ def cleanup(signum, frame):
             os.waitpid(ffmpeg_pid, 0)
         except (OSError, ProcessLookupError):
             pass
+    if SCREEN_RECORD_MODE == "segment":
+        flush_segments(include_latest=True)
     sys.exit(0)
 
 
 signal.signal(signal.SIGTERM, cleanup)
 signal.signal(signal.SIGINT, cleanup)
 
-while True:
-    resolution = get_screen_resolution()
-    if not resolution:
-        print("ERROR: Could not get screen resolution.")
-        sys.exit(1)
-
-    timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
-    filename = OUTPUT_DIR / f"screen_recording_{timestamp}.mp4"
-    progress_filename = PROGRESS_DIR / f"screen_recording_{timestamp}.mp4"
-
-    # Start ffmpeg process
-    ffmpeg_cmd = [
-        "ffmpeg",
-        "-video_size",
-        resolution,
-        "-framerate",
-        "30",
-        "-f",
-        "x11grab",
-        "-i",
-        f"{display}.0",
-        "-preset",
-        "ultrafast",
-        "-movflags",
-        "+faststart",
-        "-t",
-        str(SCREEN_RECORD_DURATION),
-        str(progress_filename),
-    ]
 
-    with open("logs/screen-record.log", "a") as log_file:
-        process = subprocess.Popen(
-            ffmpeg_cmd, stdout=log_file, stderr=log_file
-        )  # nosec B603
-        ffmpeg_pid = process.pid
-        exit_code = process.wait()
+def log_ffmpeg_error(exit_code, timestamp):
+    with open(Path.cwd() / "logs" / "error.log", "a") as error_log:
+        error_log.write(f"ERROR: ffmpeg exited with code {exit_code} at {timestamp}\n")
 
-    if exit_code != 0:
-        with open(Path.cwd() / "logs" / "error.log", "a") as error_log:
-            error_log.write(
-                f"ERROR: ffmpeg exited with code {exit_code} at {timestamp}\n"
-            )
-        sys.exit(1)
 
-    if progress_filename.exists():
-        # Move files from progress to output directory
-        for file in PROGRESS_DIR.iterdir():
-            if file.is_file():
-                file.rename(OUTPUT_DIR / file.name)
+def record_segmented():
+    """Record with a single long-lived ffmpeg using the segment muxer.
+
+    ffmpeg cuts a new file every SCREEN_RECORD_DURATION seconds without
+    restarting, so there are no gaps between clips. A watcher thread moves
+    each finished segment to OUTPUT_DIR. ffmpeg is only restarted when the
+    resource monitor changes the profile or resumes after a pause, or when
+    the screen resolution changes.
+    """
+    segment_pattern = PROGRESS_DIR / "screen_recording_%Y-%m-%d_%H-%M-%S.mp4"
+
+    watcher = threading.Thread(target=watch_segments, daemon=True)
+    watcher.start()
+
+    while True:
+        wait_while_paused()
+        restart_requested.clear()
+        resolution = screen_resolution
+        timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+        capture_args, encoder_args = build_encoder_args(
+            SCREEN_RECORD_PROFILES[PROFILE_ORDER[profile_index]]
+        )
+
+        # Force a keyframe on every segment boundary so cuts land on time
+        ffmpeg_cmd = [
+            "ffmpeg",
+            "-video_size",
+            resolution,
+            *capture_args,
+            "-f",
+            "x11grab",
+            "-i",
+            f"{display}.0",
+            *encoder_args,
+            "-force_key_frames",
+            f"expr:gte(t,n_forced*{SCREEN_RECORD_DURATION})",
+            "-f",
+            "segment",
+            "-segment_time",
+            str(SCREEN_RECORD_DURATION),
+            "-segment_format",
+            "mp4",
+            "-segment_format_options",
+            "movflags=+faststart",
+            "-reset_timestamps",
+            "1",
+            "-strftime",
+            "1",
+            str(segment_pattern),
+        ]
+
+        with open("logs/screen-record.log", "a") as log_file:
+            process = start_ffmpeg(ffmpeg_cmd, log_file)
+            exit_code = process.wait()
+
+        flush_segments(include_latest=True)
+
+        # ffmpeg exits with 255 when stopped with SIGINT by the monitor
+        if restart_requested.is_set() or paused.is_set():
+            continue
+
+        if exit_code != 0:
+            log_ffmpeg_error(exit_code, timestamp)
+            sys.exit(1)
+
+
+def record_restart():
+    """Record fixed-length clips by restarting ffmpeg for each one."""
+    while True:
+        wait_while_paused()
+        restart_requested.clear()
+        resolution = screen_resolution
+        if not resolution:
+            print("ERROR: Could not get screen resolution.")
+            sys.exit(1)
+
+        timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+        progress_filename = PROGRESS_DIR / f"screen_recording_{timestamp}.mp4"
+        capture_args, encoder_args = build_encoder_args(
+            SCREEN_RECORD_PROFILES[PROFILE_ORDER[profile_index]]
+        )
+
+        # Start ffmpeg process
+        ffmpeg_cmd = [
+            "ffmpeg",
+            "-video_size",
+            resolution,
+            *capture_args,
+            "-f",
+            "x11grab",
+            "-i",
+            f"{display}.0",
+            *encoder_args,
+            "-movflags",
+            "+faststart",
+            "-t",
+            str(SCREEN_RECORD_DURATION),
+            str(progress_filename),
+        ]
+
+        with open("logs/screen-record.log", "a") as log_file:
+            process = start_ffmpeg(ffmpeg_cmd, log_file)
+            exit_code = process.wait()
+        cpu_seconds = get_children_cpu_seconds() - cpu_base
+
+        if exit_code != 0 and not (restart_requested.is_set() or paused.is_set()):
+            log_ffmpeg_error(exit_code, timestamp)
+            sys.exit(1)
+
+        if progress_filename.exists():
+            # Move files from progress to output directory
+            moved = move_completed_segments(include_latest=True)
+            write_recording_stats(moved, cpu_seconds)
+
+
+threading.Thread(target=monitor_resources, daemon=True).start()
+threading.Thread(target=watch_resolution, daemon=True).start()
+
+if SCREEN_RECORD_MODE == "segment":
+    record_segmented()
+else:
+    record_restart()
@@ -7,6 +7,8 @@ sudo ./requirements.sh
 # Install screen recording, automatic uploading, and logging command
 cd ./screen-record/ || exit
 sudo ../setup/install-screen-record.sh
+cd ../uploader/ || exit
+sudo ../setup/install-uploader.sh
 
 # Install command, activity watch and network logging
 cd ../verbose-log/ || exit
@@ -14,6 +16,7 @@ sudo mkdir -p ./logs
 sudo chmod 777 ./logs
 ../setup/install-command-log.py
 sudo ../setup/install-logcmd.sh
+sudo ../setup/install-window-log.sh
 sudo ../setup/install-bpf-log.sh
 
 # Ensure latest kernel headers are installed for BPF service
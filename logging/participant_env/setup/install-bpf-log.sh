@@ -12,6 +12,7 @@ set -euo pipefail
 SCRIPTS=(tcp-tracker.bt udp-tracker.bt)
 SERVICE_PREFIX="bpf"             # final names: bpf-tcp-tracker.service …
 BPFTRACE_BIN="/usr/bin/bpftrace" # adjust if different
+PYTHON_BIN="/usr/bin/python3"
 RESTART_SEC=10
 
 # ────────────────────────────────
@@ -20,6 +21,8 @@ RESTART_SEC=10
 BASE_DIR="$(pwd)"
 BPF_DIR="${BASE_DIR}/bpf-scripts"
 LOG_DIR="${BASE_DIR}/network-logs"
+COMPRESS_SCRIPT="${BASE_DIR}/bpf-compress.py"
+FLOWS_SCRIPT="${BASE_DIR}/bpf-flows.py"
 
 mkdir -p "${LOG_DIR}"
 
@@ -40,6 +43,11 @@ for s in "${SCRIPTS[@]}"; do
 	log_file="${LOG_DIR}/${s%.bt}.log"
 	script_path="${BPF_DIR}/${s}"
 
+	# bpftrace events are aggregated into flow records, then compressed into
+	# rotated ${s%.bt}-*.jsonl.zst files; the log file only receives bpftrace
+	# errors and compression stats. Pass --sample N to bpf-flows.py to keep
+	# every Nth raw event as well.
+
 	sudo tee "${svc_path}" >/dev/null <<EOF
 [Unit]
 Description=BPF telemetry – ${s}
@@ -48,7 +56,7 @@ Wants=network-online.target
 
 [Service]
 Type=simple
-ExecStart=/usr/bin/bash -c '${BPFTRACE_BIN} ${script_path} >> ${log_file} 2>&1'
+ExecStart=/usr/bin/bash -c 'set -o pipefail; ${BPFTRACE_BIN} ${script_path} 2>> ${log_file} | ${PYTHON_BIN} ${FLOWS_SCRIPT} | ${PYTHON_BIN} ${COMPRESS_SCRIPT} ${s%.bt} >> ${log_file} 2>&1'
 WorkingDirectory=${BASE_DIR}
 User=root
 KillSignal=SIGINT
@@ -82,4 +90,4 @@ else
 	echo "Services enabled; they will start at the next boot."
 fi
 
-echo "Logs are written to:  ${LOG_DIR}/<script>.log"
+echo "Logs are written to:  ${LOG_DIR}/<script>-<timestamp>.jsonl.zst"
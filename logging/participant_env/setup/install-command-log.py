@@ -27,9 +27,32 @@ if [ -z "$UNDER_ASCIINEMA" ] && [ -t 1 ]; then
     LOG_DIR="$HOME/participant_env/verbose-log/logs"
     mkdir -p "$LOG_DIR"
 
-    LOGF="$LOG_DIR/command-logs-$(date +%Y%m%d-%H%M%S)-$$-$USER.log"
-
-    asciinema rec --stdin -q -c "$SHELL" "$LOGF"
+    LOGF="$LOG_DIR/command-logs-$(date +%Y%m%d-%H%M%S)-$$-$USER"
+    CAST_FIFO="$(mktemp -u /tmp/cast-XXXXXX)"
+    mkfifo -m 600 "$CAST_FIFO"
+
+    # Split the cast into size/time limited segments, gzipping closed ones
+    read -r ROTATE_PID < <(python3 "$HOME/participant_env/verbose-log/cast-rotate.py" "$CAST_FIFO" "$LOGF" >/dev/null & echo $!)
+
+    # asciinema blocks opening the FIFO until there is a reader, so only
+    # record through it once the rotator is waiting on it. If the rotator
+    # fails to start, record straight to a single file instead.
+    for _ in $(seq 50); do
+        [ -e "$CAST_FIFO.ready" ] && break
+        kill -0 "$ROTATE_PID" 2>/dev/null || break
+        sleep 0.1
+    done
+    if [ -e "$CAST_FIFO.ready" ] && kill -0 "$ROTATE_PID" 2>/dev/null; then
+        asciinema rec --stdin -q -c "$SHELL" "$CAST_FIFO"
+    else
+        echo "cast-rotate.py did not start, recording without rotation" >&2
+        asciinema rec --stdin -q -c "$SHELL" "$LOGF.log"
+    fi
+
+    # Unblock the rotator in case asciinema never opened the FIFO
+    exec 3<>"$CAST_FIFO"
+    exec 3>&-
+    rm -f "$CAST_FIFO" "$CAST_FIFO.ready"
     exit
 fi
 {ENDMARKER}"""
@@ -11,25 +11,74 @@ LOGS_DIR="${SCRIPT_DIR}/logs"
 LOG_PATH="${LOGS_DIR}/events.log"
 LOG_COMMAND_PATH="/usr/local/bin/log"
 
-# Add custom logging command to path
-read -r -d '' COSTUMLOG_SCRIPT <<EOF
-#!/bin/bash
-
-LOG_FILE=${LOG_PATH}
+# Add custom logging command to path. It only uses bash builtins, so marking
+# an event costs no extra processes, and each marker is a single JSON line
+# appended with one write() so concurrent shells never interleave.
+{
+	echo "#!/bin/bash"
+	echo
+	echo "LOG_FILE=${LOG_PATH}"
+	cat <<"EOF"
 
-if [[ "\$1" == "--help" || "\$1" == "-h" ]]; then
-    echo "Usage: log \"your message here\""
-    echo "Appends a timestamped message to \$LOG_FILE."
-    echo "Format: YYYY-MM-DD_HH-MM-SS           \"your message here\""
+if [[ "$1" == "--help" || "$1" == "-h" ]]; then
+    echo "Usage: log [--window] \"your message here\""
+    echo "Appends a JSON line with the message to $LOG_FILE."
+    echo "Fields: ts (UTC), mono (seconds since boot), host, user, msg and,"
+    echo "with --window, the title of the active window."
     exit 0
 fi
 
-TIMESTAMP=\$(date '+%Y-%m-%d_%H-%M-%S')
+window=""
+if [[ "$1" == "--window" ]]; then
+    shift
+    window="$(xdotool getactivewindow getwindowname 2>/dev/null)"
+fi
 
-echo "\$TIMESTAMP           \"\$*\"" >> "\$LOG_FILE"
-EOF
+json_escape() {
+    local s="$1"
+    s="${s//\\/\\\\}"
+    s="${s//\"/\\\"}"
+    s="${s//$'\n'/\\n}"
+    s="${s//$'\r'/\\r}"
+    s="${s//$'\t'/\\t}"
+    s="${s//[$'\x01'-$'\x1f']/}"
+    printf -v "$2" '%s' "$s"
+}
+
+# Cut an escaped string to at most $2 bytes without splitting an escape
+truncate_escaped() {
+    local s="${1:0:$2}"
+    local backslashes="${s##*[!\\]}"
+    if (( ${#backslashes} % 2 )); then
+        s="${s%\\}"
+    fi
+    printf -v "$3" '%s' "$s"
+}
 
-echo "${COSTUMLOG_SCRIPT}" >"${LOG_COMMAND_PATH}"
+export LC_ALL=C TZ=UTC
+now="${EPOCHREALTIME}"
+printf -v ts '%(%Y-%m-%dT%H:%M:%S)T.%sZ' "${now%.*}" "${now#*.}"
+read -r mono _ </proc/uptime
+
+msg="$*"
+json_escape "${msg:0:4000}" msg
+json_escape "${window:0:500}" window
+truncate_escaped "${window}" 500 window
+json_escape "${USER:-$(id -un)}" user
+
+head="{\"ts\":\"${ts}\",\"mono\":${mono},\"host\":\"${HOSTNAME}\",\"user\":\"${user}\",\"msg\":\""
+tail="\""
+if [[ -n "${window}" ]]; then
+    tail+=",\"window\":\"${window}\""
+fi
+tail+="}"
+
+# Escaping can double the message, so cap it after escaping: the whole line,
+# newline included, must fit in the 4096 byte buffer to go out in one write()
+truncate_escaped "${msg}" $((4096 - ${#head} - ${#tail} - 1)) msg
+printf '%s%s%s\n' "${head}" "${msg}" "${tail}" >>"$LOG_FILE"
+EOF
+} >"${LOG_COMMAND_PATH}"
 
 chmod +x "${LOG_COMMAND_PATH}"
 touch "${LOG_PATH}"
@@ -0,0 +1,63 @@
+#!/bin/bash
+
+if [[ ${EUID} -ne 0 ]]; then
+	echo "This script must be run as root. Use: sudo $0"
+	exit 1
+fi
+
+# === Common Paths ===
+SCRIPT_PATH="$(realpath uploader.py)"
+BASE_DIR="$(dirname "${SCRIPT_PATH}")"
+LOGS_DIR="${BASE_DIR}/logs"
+
+# === uploader.service Setup ===
+UPLOAD_SCRIPT="${BASE_DIR}/uploader.py"
+UPLOAD_LOG="${LOGS_DIR}/uploader.log"
+UPLOAD_SERVICE="/etc/systemd/system/uploader.service"
+
+# The uploader cannot run without a bucket, don't enable a service that
+# would only fail
+BUCKET_NAME="$(cd "${BASE_DIR}/../../gcp_utils" && python3 -c 'from config import BUCKET_NAME; print(BUCKET_NAME)')"
+if [[ -z ${BUCKET_NAME} ]]; then
+	echo "BUCKET_NAME is not set in gcp_utils/config.py, not installing the uploader."
+	exit 1
+fi
+
+mkdir -p "${LOGS_DIR}"
+touch "${UPLOAD_LOG}"
+chown -R "${SUDO_USER}:${SUDO_USER}" "${BASE_DIR}"
+
+tee "${UPLOAD_SERVICE}" >/dev/null <<EOF
+[Unit]
+Description=Participant log and recording uploader
+Wants=network-online.target
+After=network-online.target
+
+[Service]
+ExecStart=${UPLOAD_SCRIPT}
+Restart=always
+RestartSec=15s
+# Exit status EX_CONFIG: BUCKET_NAME is not set, restarting will not help
+RestartPreventExitStatus=78
+User=${SUDO_USER}
+WorkingDirectory=${BASE_DIR}
+StandardOutput=append:${UPLOAD_LOG}
+StandardError=append:${UPLOAD_LOG}
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+# === Enable uploader service ===
+systemctl daemon-reload
+systemctl enable uploader
+
+read -r -p "Start uploading now? (y/n): " start_upload
+if [[ ${start_upload} == "y" ]]; then
+	systemctl restart uploader
+	echo "Uploader started. Check: systemctl status uploader"
+else
+	echo "Uploader will start automatically on boot."
+fi
+
+echo "Uploader installation complete."
@@ -0,0 +1,52 @@
+#!/bin/bash
+
+if [[ ${EUID} -ne 0 ]]; then
+	echo "This script must be run as root. Use: sudo $0"
+	exit 1
+fi
+
+# === Common Paths ===
+SCRIPT_PATH="$(realpath window-log.py)"
+BASE_DIR="$(dirname "${SCRIPT_PATH}")"
+LOGS_DIR="${BASE_DIR}/logs"
+
+# === window-log.service Setup ===
+WINDOW_SCRIPT="${BASE_DIR}/window-log.py"
+WINDOW_LOG="${LOGS_DIR}/window-log.log"
+WINDOW_SERVICE="/etc/systemd/system/window-log.service"
+
+mkdir -p "${LOGS_DIR}"
+touch "${WINDOW_LOG}"
+chmod 777 "${WINDOW_LOG}"
+chown -R "${SUDO_USER}:${SUDO_USER}" "${BASE_DIR}"
+
+tee "${WINDOW_SERVICE}" >/dev/null <<EOF
+[Unit]
+Description=Active Window Logger
+
+[Service]
+ExecStart=${WINDOW_SCRIPT}
+Restart=always
+RestartSec=15s
+User=${SUDO_USER}
+WorkingDirectory=${BASE_DIR}
+StandardOutput=append:${WINDOW_LOG}
+StandardError=append:${WINDOW_LOG}
+
+[Install]
+WantedBy=multi-user.target
+EOF
+
+# === Enable window logging service ===
+systemctl daemon-reload
+systemctl enable window-log
+
+read -r -p "Start window logging now? (y/n): " start_log
+if [[ ${start_log} == "y" ]]; then
+	systemctl restart window-log
+	echo "Window logging started. Check: systemctl status window-log"
+else
+	echo "Window logging will start automatically on boot."
+fi
+
+echo "Active window logging installation complete."
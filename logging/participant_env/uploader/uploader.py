@@ -0,0 +1,371 @@
+#!/usr/bin/env python3
+
+import concurrent.futures
+import logging
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+# Import configuration
+sys.path.append(str(Path(__file__).parent.parent.parent / "gcp_utils"))
+from config import (
+    BUCKET_NAME,
+    COMMAND_LOG_ARCHIVE_PATTERN,
+    COMMAND_LOG_DIR,
+    COMMAND_LOG_PATTERN,
+    COMMAND_LOG_ROTATE_SECONDS,
+    LOG_TAG,
+    NETWORK_DICT_PATTERN,
+    NETWORK_LOG_DIR,
+    NETWORK_LOG_PATTERN,
+    SCOPES,
+    SCREEN_RECORD_LOG_DIR,
+    SCREEN_RECORD_PATTERN,
+    STORAGE_ENDPOINT,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_BURST,
+    UPLOAD_LEDGER_FILE,
+    UPLOAD_RATE_LIMIT,
+    UPLOAD_SCAN_SLEEP_TIME,
+    UPLOAD_SETTLE_TIME,
+    UPLOAD_WORKERS,
+)
+
+# === Setup paths ===
+ENV_DIR = Path(__file__).resolve().parent.parent
+LEDGER_PATH = Path.cwd() / UPLOAD_LEDGER_FILE
+LEDGER_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+# Directories to ship, the object prefix each one is uploaded under, its
+# priority class and how long a file must be unmodified before it is sent.
+# Lower classes go first: small text logs are sent before the large
+# recordings, and within a class files are sent oldest first.
+# Uncompressed command logs are the segment a shell is still writing to, they
+# are gzipped once closed. Waiting for them to be idle for a full rotation
+# period means only abandoned segments, e.g. of a crashed shell, are sent as
+# is, instead of re-uploading the open segment on every change.
+SOURCES = [
+    (
+        "command-logs",
+        ENV_DIR / "verbose-log" / COMMAND_LOG_DIR,
+        COMMAND_LOG_PATTERN,
+        0,
+        COMMAND_LOG_ROTATE_SECONDS,
+    ),
+    (
+        "command-logs",
+        ENV_DIR / "verbose-log" / COMMAND_LOG_DIR,
+        COMMAND_LOG_ARCHIVE_PATTERN,
+        0,
+        UPLOAD_SETTLE_TIME,
+    ),
+    (
+        "network-logs",
+        ENV_DIR / "verbose-log" / NETWORK_LOG_DIR,
+        NETWORK_LOG_PATTERN,
+        0,
+        UPLOAD_SETTLE_TIME,
+    ),
+    (
+        "network-logs",
+        ENV_DIR / "verbose-log" / NETWORK_LOG_DIR,
+        NETWORK_DICT_PATTERN,
+        0,
+        UPLOAD_SETTLE_TIME,
+    ),
+    (
+        "recordings",
+        ENV_DIR / "screen-record" / SCREEN_RECORD_LOG_DIR,
+        SCREEN_RECORD_PATTERN,
+        1,
+        UPLOAD_SETTLE_TIME,
+    ),
+]
+
+# GCS requires every chunk except the last to be a multiple of 256 KiB
+CHUNK_ALIGNMENT = 256 * 1024
+CHUNK_SIZE = max(CHUNK_ALIGNMENT, UPLOAD_CHUNK_SIZE // CHUNK_ALIGNMENT * CHUNK_ALIGNMENT)
+
+# Point STORAGE_EMULATOR_HOST at a fake-gcs-server for local testing
+EMULATOR_HOST = os.environ.get("STORAGE_EMULATOR_HOST")
+ENDPOINT = (EMULATOR_HOST or STORAGE_ENDPOINT).rstrip("/")
+HOSTNAME = socket.gethostname()
+
+logging.basicConfig(
+    level=logging.INFO, format=f"%(asctime)s {LOG_TAG}: %(levelname)s %(message)s"
+)
+log = logging.getLogger(LOG_TAG)
+
+
+class UploadError(Exception):
+    """Raised when the storage service rejects an upload request."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket shared by all upload workers.
+
+    Tokens are bytes. consume() may run the bucket into debt and then sleeps
+    until it is paid back, so large reads are smoothed out instead of refused.
+    A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        if self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class ThrottledBody:
+    """File-like request body that draws from a TokenBucket as it is read.
+
+    requests takes the Content-Length from __len__ and the HTTP layer reads
+    the body in small blocks, so the rate cap applies while a chunk is on
+    the wire rather than once per chunk.
+    """
+
+    def __init__(self, data, bucket):
+        self.data = data
+        self.bucket = bucket
+        self.pos = 0
+
+    def __len__(self):
+        return len(self.data)
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = len(self.data) - self.pos
+        block = self.data[self.pos : self.pos + size]
+        self.pos += len(block)
+        self.bucket.consume(len(block))
+        return block
+
+
+bucket = TokenBucket(UPLOAD_RATE_LIMIT, UPLOAD_BURST)
+
+
+class Ledger:
+    """SQLite record of which files have been sent and how far.
+
+    Rows keep the resumable session URI and the confirmed byte offset so an
+    upload interrupted by a crash or reboot continues where it stopped.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS uploads (
+                path TEXT PRIMARY KEY,
+                object_name TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime REAL NOT NULL,
+                session_uri TEXT,
+                bytes_sent INTEGER NOT NULL DEFAULT 0,
+                status TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            )"""
+        )
+        self.db.commit()
+
+    def get(self, path):
+        with self.lock:
+            return self.db.execute(
+                "SELECT object_name, size, mtime, session_uri, bytes_sent, status"
+                " FROM uploads WHERE path = ?",
+                (str(path),),
+            ).fetchone()
+
+    def save(self, path, object_name, size, mtime, session_uri, offset, status):
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (str(path), object_name, size, mtime, session_uri, offset, status, time.time()),
+            )
+            self.db.commit()
+
+    def is_uploaded(self, path, stat):
+        row = self.get(path)
+        return (
+            row is not None
+            and row[5] == "done"
+            and row[1] == stat.st_size
+            and row[2] == stat.st_mtime
+        )
+
+
+thread_state = threading.local()
+
+
+def get_session():
+    """Return this worker thread's HTTP session, creating it on first use."""
+    if not hasattr(thread_state, "session"):
+        if EMULATOR_HOST:
+            thread_state.session = requests.Session()
+        else:
+            import google.auth
+            from google.auth.transport.requests import AuthorizedSession
+
+            credentials, _ = google.auth.default(scopes=SCOPES)
+            thread_state.session = AuthorizedSession(credentials)
+    return thread_state.session
+
+
+def start_session(session, object_name, size):
+    """Open a resumable upload session and return its URI."""
+    url = f"{ENDPOINT}/upload/storage/v1/b/{BUCKET_NAME}/o"
+    resp = session.post(
+        url,
+        params={"uploadType": "resumable", "name": object_name},
+        headers={"X-Upload-Content-Length": str(size), "Content-Length": "0"},
+        timeout=30,
+    )
+    if resp.status_code != 200 or "Location" not in resp.headers:
+        raise UploadError(f"starting upload of {object_name} failed: {resp.status_code}")
+    return resp.headers["Location"]
+
+
+def committed_offset(resp):
+    """Return how many bytes the server holds according to a 308 response."""
+    byte_range = resp.headers.get("Range")
+    if not byte_range:
+        return 0
+    return int(byte_range.rsplit("-", 1)[1]) + 1
+
+
+def query_offset(session, session_uri, size):
+    """Ask the server how much of an interrupted upload it already has.
+
+    Returns the offset to continue from, size if the upload is complete, or
+    None if the session expired and the upload must start over.
+    """
+    resp = session.put(
+        session_uri,
+        headers={"Content-Range": f"bytes */{size}", "Content-Length": "0"},
+        timeout=30,
+    )
+    if resp.status_code in (200, 201):
+        return size
+    if resp.status_code == 308:
+        return committed_offset(resp)
+    if resp.status_code in (404, 410):
+        return None
+    raise UploadError(f"querying {session_uri} failed: {resp.status_code}")
+
+
+def upload_file(ledger, path, object_name):
+    """Upload one file in CHUNK_SIZE pieces, resuming a previous session."""
+    session = get_session()
+    stat = path.stat()
+    size = stat.st_size
+
+    row = ledger.get(path)
+    session_uri = offset = None
+    if row and row[3] and row[1] == size and row[2] == stat.st_mtime:
+        session_uri = row[3]
+        offset = query_offset(session, session_uri, size)
+    if offset is None:
+        session_uri = start_session(session, object_name, size)
+        offset = 0
+    ledger.save(path, object_name, size, stat.st_mtime, session_uri, offset, "partial")
+
+    with open(path, "rb") as file:
+        file.seek(offset)
+        while offset < size or size == 0:
+            chunk = file.read(CHUNK_SIZE)
+            end = offset + len(chunk) - 1
+            content_range = f"bytes {offset}-{end}/{size}" if chunk else f"bytes */{size}"
+            resp = session.put(
+                session_uri,
+                data=ThrottledBody(chunk, bucket),
+                headers={"Content-Range": content_range},
+                timeout=120,
+            )
+            if resp.status_code in (200, 201):
+                offset = size
+                break
+            if resp.status_code != 308 or not chunk:
+                raise UploadError(f"uploading {path} failed: {resp.status_code}")
+            new_offset = committed_offset(resp)
+            if new_offset != offset + len(chunk):
+                file.seek(new_offset)
+            offset = new_offset
+            ledger.save(path, object_name, size, stat.st_mtime, session_uri, offset, "partial")
+
+    ledger.save(path, object_name, size, stat.st_mtime, None, size, "done")
+    log.info(f"Uploaded {path} to gs://{BUCKET_NAME}/{object_name} ({size} bytes)")
+
+
+def find_pending(ledger, in_flight):
+    """Return (path, object_name) pairs that are complete and not yet sent.
+
+    A file counts as complete once it has not been modified for the settle
+    time of its source. Files changed after their upload are sent again. The
+    result is ordered by priority class, then oldest first.
+    """
+    now = time.time()
+    pending = []
+    for prefix, directory, pattern, priority, settle_time in SOURCES:
+        if not directory.is_dir():
+            continue
+        for path in directory.glob(pattern):
+            if path in in_flight or not path.is_file():
+                continue
+            stat = path.stat()
+            if now - stat.st_mtime < settle_time or ledger.is_uploaded(path, stat):
+                continue
+            pending.append((priority, stat.st_mtime, path, f"{HOSTNAME}/{prefix}/{path.name}"))
+    pending.sort(key=lambda entry: entry[:2])
+    return [(path, object_name) for _, _, path, object_name in pending]
+
+
+def main():
+    if not BUCKET_NAME:
+        # EX_CONFIG is excluded from restarts in uploader.service
+        log.error("BUCKET_NAME is not set in config.py")
+        sys.exit(os.EX_CONFIG)
+
+    ledger = Ledger(LEDGER_PATH)
+    in_flight = {}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=UPLOAD_WORKERS) as executor:
+        while True:
+            for path, future in list(in_flight.items()):
+                if not future.done():
+                    continue
+                del in_flight[path]
+                try:
+                    future.result()
+                except Exception as e:
+                    log.warning(f"Upload of {path} failed, will retry: {e}")
+
+            # Only queue as much as the pool can work on so new files are
+            # picked up in order instead of behind a long backlog
+            for path, object_name in find_pending(ledger, in_flight):
+                if len(in_flight) >= UPLOAD_WORKERS:
+                    break
+                in_flight[path] = executor.submit(upload_file, ledger, path, object_name)
+
+            time.sleep(UPLOAD_SCAN_SLEEP_TIME)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+
+import json
+import queue
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+
+import zstandard as zstd
+
+# Import configuration
+sys.path.append(str(Path(__file__).parent.parent.parent / "gcp_utils"))
+from config import (
+    LOG_DIR_PERMISSIONS,
+    LOG_FILE_PERMISSIONS,
+    NETWORK_LOG_DICT_SAMPLES,
+    NETWORK_LOG_DICT_SECONDS,
+    NETWORK_LOG_DICT_SIZE,
+    NETWORK_LOG_DIR,
+    NETWORK_LOG_QUEUE_SIZE,
+    NETWORK_LOG_ROTATE_BYTES,
+    NETWORK_LOG_ROTATE_SECONDS,
+    NETWORK_LOG_STATS_INTERVAL,
+    NETWORK_LOG_ZSTD_LEVEL,
+)
+
+# === Setup paths ===
+OUTPUT_DIR = Path.cwd() / NETWORK_LOG_DIR
+OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+OUTPUT_DIR.chmod(LOG_DIR_PERMISSIONS)
+
+# Marks the end of the stream on the queue
+STOP = None
+
+
+class Stats:
+    """Counters shared by the reader and the compressor thread."""
+
+    def __init__(self):
+        self.lines = 0
+        self.dropped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.files = 0
+
+    def as_dict(self, name, open_bytes=0):
+        bytes_out = self.bytes_out + open_bytes
+        return {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "stream": name,
+            "lines": self.lines,
+            "dropped": self.dropped,
+            "bytes_in": self.bytes_in,
+            "bytes_out": bytes_out,
+            "ratio": round(self.bytes_in / bytes_out, 2) if bytes_out else None,
+            "files": self.files,
+        }
+
+
+def load_dictionary(name):
+    """Return the newest trained dictionary for this stream, if any."""
+    dicts = sorted(OUTPUT_DIR.glob(f"{name}-*.dict"), key=lambda path: path.stat().st_mtime)
+    if not dicts:
+        return None
+    return zstd.ZstdCompressionDict(dicts[-1].read_bytes())
+
+
+def train_dictionary(name, samples):
+    """Train a dictionary on sample lines and save it next to the logs.
+
+    The dictionary is needed to decompress the files, so it is stored as
+    <name>-<dict_id>.dict and shipped along with them. Returns None if there
+    are too few samples to train on.
+    """
+    try:
+        dictionary = zstd.train_dictionary(NETWORK_LOG_DICT_SIZE, samples)
+    except zstd.ZstdError:
+        return None
+    path = OUTPUT_DIR / f"{name}-{dictionary.dict_id()}.dict"
+    path.write_bytes(dictionary.as_bytes())
+    path.chmod(LOG_FILE_PERMISSIONS)
+    return dictionary
+
+
+class RotatingWriter:
+    """Write lines into zstd files that rotate by size and age.
+
+    The open file carries a .partial suffix and is only renamed to its final
+    <name>-<timestamp>.jsonl.zst name once closed, so the uploader never
+    picks up a file that is still being written.
+    """
+
+    def __init__(self, name, dictionary, stats):
+        self.name = name
+        self.stats = stats
+        self.compressor = zstd.ZstdCompressor(level=NETWORK_LOG_ZSTD_LEVEL, dict_data=dictionary)
+        self.file = None
+        self.writer = None
+
+    def open(self):
+        timestamp = time.strftime("%Y-%m-%d_%H-%M-%S")
+        self.path = OUTPUT_DIR / f"{self.name}-{timestamp}.jsonl.zst"
+        self.partial_path = self.path.with_name(self.path.name + ".partial")
+        self.file = open(self.partial_path, "wb")
+        self.partial_path.chmod(LOG_FILE_PERMISSIONS)
+        self.writer = self.compressor.stream_writer(self.file, closefd=False)
+        self.opened_at = time.monotonic()
+        self.bytes_in = 0
+
+    def close(self):
+        if not self.writer:
+            return
+        self.writer.close()
+        self.stats.bytes_out += self.file.tell()
+        self.file.close()
+        self.partial_path.rename(self.path)
+        self.stats.files += 1
+        self.writer = None
+
+    def write(self, line):
+        if not self.writer:
+            self.open()
+        self.writer.write(line)
+        self.bytes_in += len(line)
+        self.stats.bytes_in += len(line)
+        if (
+            self.bytes_in >= NETWORK_LOG_ROTATE_BYTES
+            or time.monotonic() - self.opened_at >= NETWORK_LOG_ROTATE_SECONDS
+        ):
+            self.close()
+
+    def rotate_if_old(self, now):
+        """Close the open file once it reaches its age limit, even if no
+        lines arrive to trigger the check in write()."""
+        if self.writer and now - self.opened_at >= NETWORK_LOG_ROTATE_SECONDS:
+            self.close()
+
+    def flush(self):
+        # End the current zstd block so a crash loses at most one interval
+        if self.writer:
+            self.writer.flush(zstd.FLUSH_BLOCK)
+
+    def open_bytes(self):
+        """Compressed bytes written to the file that is still open."""
+        return self.file.tell() if self.writer else 0
+
+
+def start_writer(name, samples, stats):
+    """Train a dictionary on the held back lines and write them out.
+
+    With too few samples to train on, the files are compressed without a
+    dictionary until the next restart.
+    """
+    writer = RotatingWriter(name, train_dictionary(name, samples), stats)
+    for sample in samples:
+        writer.write(sample)
+    return writer
+
+
+def compress(name, lines, stats):
+    """Compressor thread: drain the queue into rotating zstd files.
+
+    Until a dictionary exists, lines are held back to train one. Training
+    starts after NETWORK_LOG_DICT_SAMPLES lines or NETWORK_LOG_DICT_SECONDS,
+    whichever comes first, so a crash loses at most that much.
+    """
+    dictionary = load_dictionary(name)
+    samples = []
+    writer = RotatingWriter(name, dictionary, stats) if dictionary else None
+    last_flush = last_stats = time.monotonic()
+    training_started = None
+
+    while True:
+        try:
+            line = lines.get(timeout=1)
+        except queue.Empty:
+            line = ""
+        if line is STOP:
+            break
+
+        if line:
+            if writer:
+                writer.write(line)
+            else:
+                if not samples:
+                    training_started = time.monotonic()
+                samples.append(line)
+
+        now = time.monotonic()
+        if writer:
+            writer.rotate_if_old(now)
+        if samples and (
+            len(samples) >= NETWORK_LOG_DICT_SAMPLES
+            or now - training_started >= NETWORK_LOG_DICT_SECONDS
+        ):
+            writer = start_writer(name, samples, stats)
+            samples = []
+        if writer and now - last_flush >= 1:
+            writer.flush()
+            last_flush = now
+        if now - last_stats >= NETWORK_LOG_STATS_INTERVAL:
+            open_bytes = writer.open_bytes() if writer else 0
+            print(json.dumps(stats.as_dict(name, open_bytes)), flush=True)
+            last_stats = now
+
+    if not writer and samples:
+        writer = start_writer(name, samples, stats)
+    if writer:
+        writer.close()
+
+
+def main():
+    if len(sys.argv) != 2:
+        print(f"Usage: bpftrace <script> | {sys.argv[0]} <stream name>", file=sys.stderr)
+        sys.exit(1)
+    name = sys.argv[1]
+
+    stats = Stats()
+    lines = queue.Queue(maxsize=NETWORK_LOG_QUEUE_SIZE)
+    compressor = threading.Thread(target=compress, args=(name, lines, stats))
+    compressor.start()
+
+    # Stop cleanly on SIGTERM as well as SIGINT. Inside a pipeline SIGINT
+    # reaches every stage at once, so keep reading until the upstream stage
+    # closes the pipe and nothing it flushes on exit is lost.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    if not sys.stdin.isatty():
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    # Reading stdin must never block on compression, otherwise bpftrace
+    # backs up and loses events in the kernel. Lines that do not fit into
+    # the queue are dropped and counted instead.
+    try:
+        for line in sys.stdin.buffer:
+            stats.lines += 1
+            try:
+                lines.put_nowait(line)
+            except queue.Full:
+                stats.dropped += 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        lines.put(STOP)
+        compressor.join()
+        print(json.dumps(stats.as_dict(name)), flush=True)
+
+
+if __name__ == "__main__":
+    main()
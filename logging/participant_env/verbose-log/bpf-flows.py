@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+
+import argparse
+import calendar
+import json
+import queue
+import signal
+import sys
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+
+# Import configuration
+sys.path.append(str(Path(__file__).parent.parent.parent / "gcp_utils"))
+from config import FLOW_IDLE_TIMEOUT, FLOW_RAW_SAMPLE, FLOW_TABLE_MAX, NETWORK_LOG_QUEUE_SIZE
+
+# Events that carry traffic for a flow, mapped to the direction they count as
+TRAFFIC_EVENTS = {
+    "tcp_send": "sent",
+    "tcp_recv": "recv",
+    "udp_send": "sent",
+    "udp_recv": "recv",
+}
+STATE_EVENTS = {"tcp_connect", "tcp_state_change"}
+
+# inet_sock_set_state new state that ends a TCP flow
+TCP_CLOSE = 7
+
+# Seconds between idle sweeps, in event time. While no events arrive, the
+# aggregator also sweeps after waiting this long for one.
+SWEEP_INTERVAL = 1
+
+# Marks the end of the stream on the queue
+STOP = None
+
+
+class Flow:
+    """Running totals for one 5-tuple."""
+
+    __slots__ = (
+        "proto",
+        "key",
+        "pid",
+        "comm",
+        "first_ts",
+        "last_ts",
+        "last_seen",
+        "bytes_sent",
+        "bytes_recv",
+        "packets_sent",
+        "packets_recv",
+        "states",
+    )
+
+    def __init__(self, proto, key, event, seen):
+        self.proto = proto
+        self.key = key
+        self.pid = event.get("pid")
+        self.comm = event.get("comm")
+        self.first_ts = event["ts"]
+        self.last_ts = event["ts"]
+        self.last_seen = seen
+        self.bytes_sent = 0
+        self.bytes_recv = 0
+        self.packets_sent = 0
+        self.packets_recv = 0
+        self.states = []
+
+    def record(self, reason):
+        src_ip, src_port, dst_ip, dst_port = self.key[1:5]
+        return {
+            "evt": "flow",
+            "proto": self.proto,
+            "pid": self.pid,
+            "comm": self.comm,
+            "src_ip": src_ip,
+            "src_port": src_port,
+            "dst_ip": dst_ip,
+            "dst_port": dst_port,
+            "first_ts": self.first_ts,
+            "last_ts": self.last_ts,
+            "bytes_sent": self.bytes_sent,
+            "bytes_recv": self.bytes_recv,
+            "packets_sent": self.packets_sent,
+            "packets_recv": self.packets_recv,
+            "states": self.states,
+            "end": reason,
+        }
+
+
+class FlowTable:
+    """Flow table ordered by last activity, evicting idle flows.
+
+    Timing uses the event timestamps rather than the wall clock, so replaying
+    an old log produces the same flows as the live stream did. Only when the
+    stream goes quiet does tick() advance event time by the wall time since
+    the newest event, so flows still end once they have been idle long enough.
+    """
+
+    def __init__(self, out, idle_timeout, max_flows):
+        self.out = out
+        self.idle_timeout = idle_timeout
+        self.max_flows = max_flows
+        self.flows = OrderedDict()
+        self.next_sweep = 0
+        self.ts_cache = (None, 0)
+        # Event time of the newest event and the monotonic time it was added
+        self.clock = None
+
+    def seconds(self, ts):
+        """Convert an event timestamp like 2024-01-01T00:00:00.123456Z to epoch seconds.
+
+        Only the whole-second part is parsed with strptime, and that result is
+        cached since consecutive events almost always share it.
+        """
+        base = ts[:19]
+        if base != self.ts_cache[0]:
+            self.ts_cache = (base, calendar.timegm(time.strptime(base, "%Y-%m-%dT%H:%M:%S")))
+        fraction = ts[19:].rstrip("Z")
+        return self.ts_cache[1] + (float(fraction) if fraction else 0)
+
+    def emit(self, flow, reason):
+        self.out.write(json.dumps(flow.record(reason)) + "\n")
+
+    def add(self, event):
+        evt = event.get("evt")
+        if evt not in TRAFFIC_EVENTS and evt not in STATE_EVENTS:
+            return False
+        proto = evt.split("_", 1)[0]
+        # udp_recv only carries the pid, so it is kept as a per-process flow
+        key = (
+            proto,
+            event.get("src_ip"),
+            event.get("src_port"),
+            event.get("dst_ip"),
+            event.get("dst_port"),
+            event.get("pid") if evt == "udp_recv" else None,
+        )
+        seen = self.seconds(event["ts"])
+        self.clock = (seen, time.monotonic())
+
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = self.flows[key] = Flow(proto, key, event, seen)
+            if len(self.flows) > self.max_flows:
+                _, oldest = self.flows.popitem(last=False)
+                self.emit(oldest, "evicted")
+        else:
+            self.flows.move_to_end(key)
+            flow.last_ts = event["ts"]
+            flow.last_seen = seen
+
+        direction = TRAFFIC_EVENTS.get(evt)
+        if direction == "sent":
+            flow.bytes_sent += event.get("bytes", 0)
+            flow.packets_sent += 1
+        elif direction == "recv":
+            flow.bytes_recv += event.get("bytes", 0)
+            flow.packets_recv += 1
+        elif evt == "tcp_connect":
+            flow.states.append([event["ts"], "connect"])
+        else:
+            flow.states.append([event["ts"], event.get("oldstate"), event.get("newstate")])
+            if event.get("newstate") == TCP_CLOSE:
+                del self.flows[key]
+                self.emit(flow, "closed")
+
+        if seen >= self.next_sweep:
+            self.sweep(seen)
+            self.next_sweep = seen + SWEEP_INTERVAL
+        return True
+
+    def sweep(self, now):
+        """Emit flows idle for longer than the timeout, oldest first.
+
+        Returns the number of flows emitted.
+        """
+        count = 0
+        while self.flows:
+            key, flow = next(iter(self.flows.items()))
+            if now - flow.last_seen < self.idle_timeout:
+                break
+            del self.flows[key]
+            self.emit(flow, "idle")
+            count += 1
+        return count
+
+    def tick(self):
+        """Sweep while no events arrive. Returns the number of flows emitted."""
+        if self.clock is None:
+            return 0
+        seen, added = self.clock
+        now = seen + time.monotonic() - added
+        if now < self.next_sweep:
+            return 0
+        self.next_sweep = now + SWEEP_INTERVAL
+        return self.sweep(now)
+
+    def flush(self):
+        for flow in self.flows.values():
+            self.emit(flow, "shutdown")
+        self.flows.clear()
+
+
+def aggregate(lines, out, idle_timeout, sample):
+    """Aggregator thread: parse queued bpftrace lines into flow records."""
+    table = FlowTable(out, idle_timeout, FLOW_TABLE_MAX)
+    raw_count = 0
+    while True:
+        try:
+            line = lines.get(timeout=SWEEP_INTERVAL)
+        except queue.Empty:
+            # Hand flows that ended during a quiet period on right away
+            # instead of leaving them in the output buffer
+            if table.tick():
+                out.flush()
+            continue
+        if line is STOP:
+            break
+        try:
+            event = json.loads(line)
+        except ValueError:
+            continue
+        if not table.add(event):
+            # bpftrace_start and anything unknown is passed through as is
+            out.write(line)
+        elif sample and event["evt"] in TRAFFIC_EVENTS:
+            raw_count += 1
+            if raw_count % sample == 0:
+                out.write(line)
+    table.flush()
+    out.flush()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Aggregate bpftrace network events from stdin into flow records on stdout."
+    )
+    parser.add_argument(
+        "--sample",
+        type=int,
+        default=FLOW_RAW_SAMPLE,
+        help="Also pass through every Nth raw traffic event. 0 keeps none.",
+    )
+    parser.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=FLOW_IDLE_TIMEOUT,
+        help="Seconds without events before a flow is emitted.",
+    )
+    args = parser.parse_args()
+
+    # Inside a pipeline SIGINT reaches every stage at once; keep reading until
+    # bpftrace closes the pipe so the remaining flows are still written
+    if not sys.stdin.isatty():
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    lines = queue.Queue(maxsize=NETWORK_LOG_QUEUE_SIZE)
+    aggregator = threading.Thread(
+        target=aggregate, args=(lines, sys.stdout, args.idle_timeout, args.sample)
+    )
+    aggregator.start()
+
+    # As in bpf-compress.py, reading stdin must never wait for the
+    # aggregation, otherwise bpftrace backs up and loses events in the
+    # kernel. Lines that do not fit into the queue are dropped and counted.
+    dropped = 0
+    try:
+        for line in sys.stdin:
+            try:
+                lines.put_nowait(line)
+            except queue.Full:
+                dropped += 1
+    finally:
+        lines.put(STOP)
+        aggregator.join()
+        if dropped:
+            print(f"bpf-flows: dropped {dropped} events, the aggregation fell behind", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
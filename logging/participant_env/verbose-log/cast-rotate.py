@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+
+import gzip
+import json
+import os
+import queue
+import shutil
+import signal
+import sys
+import threading
+import time
+from pathlib import Path
+
+# Import configuration
+sys.path.append(str(Path(__file__).parent.parent.parent / "gcp_utils"))
+from config import COMMAND_LOG_ROTATE_BYTES, COMMAND_LOG_ROTATE_SECONDS, LOG_FILE_PERMISSIONS
+
+# Marks the end of the closed segment queue
+STOP = None
+
+
+def compress_segments(closed):
+    """Background thread: gzip closed segments and remove the originals."""
+    while True:
+        path = closed.get()
+        if path is STOP:
+            return
+        gz_path = path.with_name(path.name + ".gz")
+        try:
+            with open(path, "rb") as src, gzip.open(gz_path, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.chmod(gz_path, LOG_FILE_PERMISSIONS)
+            path.unlink()
+        except OSError as e:
+            print(f"Failed to compress {path}: {e}", file=sys.stderr)
+
+
+class SegmentWriter:
+    """Split one asciinema v2 cast into standalone segment casts.
+
+    Every segment starts with a copy of the original header whose timestamp
+    is moved to the start of the segment, and event times are made relative
+    to it, so each file plays on its own. The extra header keys "session",
+    "segment" and "time_offset" record where a segment belongs so the
+    command indexer can stitch them back together.
+    """
+
+    def __init__(self, base, header, closed):
+        self.base = base
+        self.header = header
+        self.closed = closed
+        self.segment = 0
+        self.file = None
+
+    def open(self, time_offset):
+        self.segment += 1
+        self.time_offset = time_offset
+        self.path = Path(f"{self.base}-part{self.segment:04d}.log")
+        self.file = open(self.path, "w")
+        os.chmod(self.path, LOG_FILE_PERMISSIONS)
+        header = dict(self.header)
+        header["timestamp"] = self.header.get("timestamp", 0) + time_offset
+        header["session"] = Path(self.base).name
+        header["segment"] = self.segment
+        header["time_offset"] = time_offset
+        self.file.write(json.dumps(header) + "\n")
+        self.opened_at = time.monotonic()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+            self.closed.put(self.path)
+
+    def write(self, event):
+        if self.file and (
+            self.file.tell() >= COMMAND_LOG_ROTATE_BYTES
+            or time.monotonic() - self.opened_at >= COMMAND_LOG_ROTATE_SECONDS
+        ):
+            self.close()
+        if not self.file:
+            self.open(event[0])
+        event[0] = round(event[0] - self.time_offset, 6)
+        self.file.write(json.dumps(event) + "\n")
+        # Flush per event so an open segment is always readable up to date
+        self.file.flush()
+
+
+def main():
+    if len(sys.argv) != 3:
+        print(f"Usage: {sys.argv[0]} <cast fifo> <output base path>", file=sys.stderr)
+        sys.exit(1)
+    fifo, base = sys.argv[1], sys.argv[2]
+
+    # Keep running until asciinema closes the FIFO, even when the terminal
+    # sends SIGINT or SIGHUP to the whole process group
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+
+    closed = queue.Queue()
+    compressor = threading.Thread(target=compress_segments, args=(closed,))
+    compressor.start()
+
+    # Tell the shell that the FIFO is about to get a reader
+    Path(fifo + ".ready").touch()
+    with open(fifo) as cast:
+        header_line = cast.readline()
+        if header_line:
+            writer = SegmentWriter(base, json.loads(header_line), closed)
+            for line in cast:
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                writer.write(event)
+            writer.close()
+
+    closed.put(STOP)
+    compressor.join()
+
+
+if __name__ == "__main__":
+    main()
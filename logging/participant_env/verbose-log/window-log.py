@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import select
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from Xlib import X, Xatom
+from Xlib import error as xerror
+
+# Import configuration
+sys.path.append(str(Path(__file__).parent.parent.parent / "gcp_utils"))
+from config import (
+    LOG_FILE_PERMISSIONS,
+    WINDOW_LOG_DEBOUNCE,
+    WINDOW_LOG_FILE,
+)
+from x_display import connect_display
+
+# === Setup paths ===
+LOG_PATH = Path.cwd() / WINDOW_LOG_FILE
+LOG_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+
+class WindowTracker:
+    """Follows the focused window over a single X connection.
+
+    The root window's _NET_ACTIVE_WINDOW property and the focused window's
+    title properties are watched with PropertyNotify, so nothing is polled.
+    A change is only written once focus and title have been stable for
+    WINDOW_LOG_DEBOUNCE seconds, which skips windows that are just passed
+    through while switching.
+    """
+
+    def __init__(self, connection):
+        self.x = connection
+        self.root = connection.screen().root
+        self.net_active_window = connection.intern_atom("_NET_ACTIVE_WINDOW")
+        self.net_wm_name = connection.intern_atom("_NET_WM_NAME")
+        self.utf8_string = connection.intern_atom("UTF8_STRING")
+        self.watched = None
+        self.last = None
+        self.root.change_attributes(event_mask=X.PropertyChangeMask)
+
+    def active_window(self):
+        prop = self.root.get_full_property(self.net_active_window, X.AnyPropertyType)
+        if not prop or not prop.value or not prop.value[0]:
+            return None
+        return self.x.create_resource_object("window", prop.value[0])
+
+    def describe(self, window):
+        """Return (title, class) of a window, or None if it went away."""
+        try:
+            prop = window.get_full_property(self.net_wm_name, self.utf8_string)
+            if prop and prop.value:
+                title = prop.value.decode(errors="replace")
+            else:
+                title = window.get_wm_name() or ""
+            wm_class = window.get_wm_class()
+        except xerror.XError:
+            return None
+        return title, wm_class[1] if wm_class else ""
+
+    def select_events(self, window, mask):
+        """Set the event mask of a window. Returns False if the window is gone.
+
+        ChangeWindowAttributes has no reply, so a BadWindow error arrives
+        asynchronously instead of being raised here. It is caught on the
+        request and collected with a round trip to the server.
+        """
+        catch = xerror.CatchError(xerror.BadWindow)
+        window.change_attributes(onerror=catch, event_mask=mask)
+        self.x.sync()
+        return catch.get_error() is None
+
+    def watch(self, window):
+        """Move the title subscription to the newly focused window."""
+        if self.watched is not None and (window is None or window.id != self.watched.id):
+            self.select_events(self.watched, X.NoEventMask)
+        if window is not None and not self.select_events(window, X.PropertyChangeMask):
+            window = None
+        self.watched = window
+
+    def relevant(self, event):
+        if event.type != X.PropertyNotify:
+            return False
+        if event.window.id == self.root.id:
+            return event.atom == self.net_active_window
+        return event.atom in (self.net_wm_name, Xatom.WM_NAME)
+
+    def log_change(self):
+        window = self.active_window()
+        self.watch(window)
+        described = self.describe(window) if window is not None else ("", "")
+        if described is None:
+            return
+        current = (window.id if window is not None else None, *described)
+        if current == self.last:
+            return
+        self.last = current
+        with open(LOG_PATH, "a") as log_file:
+            log_file.write(
+                json.dumps(
+                    {
+                        "ts": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                        # Seconds since boot like /proc/uptime in the log
+                        # command's markers, so both line up after a suspend
+                        "mono": round(time.clock_gettime(time.CLOCK_BOOTTIME), 6),
+                        "window": hex(current[0]) if current[0] else None,
+                        "title": current[1],
+                        "class": current[2],
+                    }
+                )
+                + "\n"
+            )
+
+    def run(self):
+        self.log_change()
+        deadline = None
+        while True:
+            timeout = max(deadline - time.monotonic(), 0) if deadline else None
+            select.select([self.x], [], [], timeout)
+            while self.x.pending_events():
+                if self.relevant(self.x.next_event()):
+                    deadline = time.monotonic() + WINDOW_LOG_DEBOUNCE
+            if deadline and time.monotonic() >= deadline:
+                deadline = None
+                self.log_change()
+
+
+def main():
+    _, connection = connect_display()
+    if connection is None:
+        print("ERROR: No valid display found.")
+        sys.exit(1)
+    if not LOG_PATH.exists():
+        LOG_PATH.touch()
+        os.chmod(LOG_PATH, LOG_FILE_PERMISSIONS)
+    WindowTracker(connection).run()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# SPDX-FileCopyrightText: 2021 Dimitri Robl
+#
+# SPDX-License-Identifier: MIT
+
+import aiohttp
+import asyncio
+import contextlib
+import exchange_lib
+import sys
+import time
+import yarl
+
+def trace_config():
+    '''trace_config: Create a trace config which fills in the
+          "connect" and "first_byte" times of the request record passed
+          as "trace_request_ctx". aiohttp reports the TCP connect and
+          the TLS handshake together, so "connect" includes the TLS
+          handshake and "tls" stays empty.
+        Return values:
+          config (aiohttp.TraceConfig) : The trace config.
+    '''
+    config = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        ctx.start = time.perf_counter()
+
+    async def on_connection_create_start(session, ctx, params):
+        ctx.connect_start = time.perf_counter()
+
+    async def on_connection_create_end(session, ctx, params):
+        ctx.trace_request_ctx['connect'] = time.perf_counter() - ctx.connect_start
+
+    async def on_request_end(session, ctx, params):
+        record = ctx.trace_request_ctx
+        record['first_byte'] = (time.perf_counter() - ctx.start
+                                - (record['connect'] or 0))
+
+    config.on_request_start.append(on_request_start)
+    config.on_connection_create_start.append(on_connection_create_start)
+    config.on_connection_create_end.append(on_connection_create_end)
+    config.on_request_end.append(on_request_end)
+    return config
+# end trace_config
+
+@contextlib.asynccontextmanager
+async def timed_request(session, fingerprint, path: str, method: str, url,
+                        **kwargs):
+    '''timed_request: asyncio version of exchange_lib.timed_request,
+          used as "async with".
+    '''
+    record = exchange_lib.new_request_record(path)
+    fingerprint['requests'].append(record)
+    start = time.perf_counter()
+    try:
+        async with session.request(method, url, trace_request_ctx=record,
+                                   **kwargs) as response:
+            record['status'] = response.status
+            yield response
+    except Exception as e:
+        record['error'] = exchange_lib.error_class(e)
+        raise
+    finally:
+        record['total'] = time.perf_counter() - start
+# end timed_request
+
+async def get_fingerprint(session, host, timeout: int, scheme='https://',
+                          debug=False):
+    '''get_fingerprint: asyncio version of exchange_lib.get_fingerprint.
+        Arguments:
+          session (aiohttp.ClientSession) : The session to use.
+          host (str)    : The host to fingerprint. Can be either an IP
+                          address or a hostname.
+          timeout (int) : The timeout for each request in seconds.
+          scheme (str)  : The scheme to use, defaults to 'https://'
+          debug (bool)  : If True, print debugging output do stderr.
+        Return values:
+          fingerprint (dict) : See exchange_lib.get_fingerprint.
+    '''
+    fingerprint = exchange_lib.empty_fingerprint(host)
+    client_timeout = aiohttp.ClientTimeout(total=timeout)
+    auto_url = scheme + host + exchange_lib.AUTODISCOVER_PATH
+    try:
+        if debug:
+            print(f'Requesting autodiscover URL "{auto_url}"',
+                  file=sys.stderr)
+        async with timed_request(session, fingerprint,
+                                 exchange_lib.AUTODISCOVER_PATH, 'GET',
+                                 auto_url,
+                                 headers=exchange_lib.FINGERPRINT_HEADERS,
+                                 timeout=client_timeout) as resp:
+            fingerprint['reachable'] = True
+            fingerprint['status_codes'][exchange_lib.AUTODISCOVER_PATH] = resp.status
+            fingerprint['headers'][exchange_lib.AUTODISCOVER_PATH] = dict(resp.headers)
+            version = resp.headers.get('X-OWA-Version')
+            # Drain the short body so the connection goes back to the pool
+            await resp.read()
+        if version:
+            fingerprint['version'] = version
+            fingerprint['version_source'] = 'autodiscover'
+            return fingerprint
+        if debug:
+            print(f'{auto_url}: No "X-OWA-Version" header.',
+                  file=sys.stderr)
+    except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+        if debug:
+            print(f'Failed to connect to {host}: {e!r}', file=sys.stderr)
+        return fingerprint
+    except Exception as e:
+        if debug:
+            print(f'Failed to parse version via autodiscover: {e!r}',
+                  file=sys.stderr)
+    owa_url = scheme + host + exchange_lib.OWA_PATH
+    try:
+        if debug:
+            print(f'Requesting OWA "{owa_url}"', file=sys.stderr)
+        async with timed_request(session, fingerprint,
+                                 exchange_lib.OWA_PATH, 'GET', owa_url,
+                                 headers=exchange_lib.FINGERPRINT_HEADERS,
+                                 timeout=client_timeout) as resp:
+            fingerprint['reachable'] = True
+            fingerprint['status_codes'][exchange_lib.OWA_PATH] = resp.status
+            fingerprint['headers'][exchange_lib.OWA_PATH] = dict(resp.headers)
+            match = None
+            tail = b''
+            read = 0
+            async for chunk in resp.content.iter_chunked(exchange_lib.OWA_CHUNK_SIZE):
+                match, tail = exchange_lib.search_chunk(
+                    exchange_lib.OWA_VERSION_REGEX, tail, chunk)
+                read += len(chunk)
+                if match or read >= exchange_lib.OWA_MAX_BYTES:
+                    break
+            # Don't download the rest of the page
+            if not resp.content.at_eof():
+                resp.close()
+            if match:
+                fingerprint['version'] = match.group('version').decode()
+                fingerprint['version_source'] = 'owa'
+                return fingerprint
+    except Exception as e:
+        if debug:
+            print(f'Failed to parse version from OWA: {e!r}',
+                  file=sys.stderr)
+    return fingerprint
+# end get_fingerprint
+
+async def check_host(session, host, cves: list, timeout=5,
+                     scheme='https://', method=None, path=None,
+                     debug=False):
+    '''check_host: asyncio version of exchange_lib.check_host. The
+          probes and the classification of their responses are the
+          same as in exchange_lib.
+        Arguments:
+          session (aiohttp.ClientSession) : The session to use.
+          host (str)    : The host to check. Can be an IP address or
+                          a hostname.
+          cves (list)   : The CVEs to check for, keys of
+                          exchange_lib.CHECKS.
+          timeout (int) : The timeout for each request in seconds.
+          scheme (str)  : The scheme to use. Default: "https://"
+          method (str)  : The HTTP method to use. Default: The
+                          default of each check.
+          path (str)    : The path on the server to access. Default:
+                          The default of each check.
+          debug (bool)  : If True, print debugging output do stderr.
+        Return values:
+          (fingerprint, results) (tuple): See exchange_lib.check_host.
+    '''
+    start = time.perf_counter()
+    fingerprint = await get_fingerprint(session, host, timeout, scheme,
+                                        debug=debug)
+    version = fingerprint['version']
+    results = {}
+    for cve in cves:
+        if not fingerprint['reachable']:
+            results[cve] = (None, None)
+            continue
+        evaluate = exchange_lib.EVALUATORS[cve]
+        probe = exchange_lib.PROBES.get(cve)
+        if probe is None:
+            results[cve] = evaluate(None, None, version)
+            continue
+        # The probe paths must be sent exactly as given
+        probe_path = path or probe['path']
+        url = yarl.URL(scheme + host + probe_path, encoded=True)
+        try:
+            if debug:
+                print(f'Requesting "{url}"', file=sys.stderr)
+            async with timed_request(session, fingerprint, probe_path,
+                                     method or probe['method'], url,
+                                     headers=probe['headers'],
+                                     timeout=aiohttp.ClientTimeout(total=timeout),
+                                     allow_redirects=False) as response:
+                await response.read()
+        except Exception as e:
+            if debug:
+                print(f'Request to {url} failed with {e!r}', file=sys.stderr)
+            results[cve] = (None, None)
+            continue
+        if debug:
+            print(f'{host}: {response.status} -- {version}', file=sys.stderr)
+        results[cve] = evaluate(response.status, response.headers, version)
+    fingerprint['elapsed'] = time.perf_counter() - start
+    return (fingerprint, results)
+# end check_host
+
+async def scan(hosts, cves: list, on_result, limit=300, timeout=5,
+               scheme='https://', method=None, path=None, debug=False):
+    '''scan: Check all hosts with at most "limit" hosts in flight.
+          Every host gets a deadline covering all of its requests, so
+          a slow host cannot hold a slot for longer than that.
+        Arguments:
+          hosts (iterable) : The hosts to check.
+          cves (list)      : The CVEs to check for.
+          on_result (function) : Called with host, fingerprint and
+                             results as soon as a host is done.
+          limit (int)      : Max number of hosts checked in parallel.
+          timeout (int)    : The timeout for each request in seconds.
+          scheme (str)     : The scheme to use. Default: "https://"
+          method (str)     : The HTTP method to use for the probes.
+          path (str)       : The path to use for the probes.
+          debug (bool)     : If True, print debugging output do stderr.
+    '''
+    connector = aiohttp.TCPConnector(limit=limit, ssl=False)
+    semaphore = asyncio.Semaphore(limit)
+    host_timeout = timeout * (2 + len(cves))
+
+    async def run(host):
+        try:
+            fingerprint, results = await asyncio.wait_for(
+                check_host(session, host, cves, timeout, scheme, method,
+                           path, debug=debug),
+                host_timeout)
+        except Exception as e:
+            if debug:
+                print(f'{host}: Check failed with {e!r}', file=sys.stderr)
+            fingerprint = exchange_lib.empty_fingerprint(host)
+            results = {cve : (None, None) for cve in cves}
+        finally:
+            semaphore.release()
+        on_result(host, fingerprint, results)
+
+    async with aiohttp.ClientSession(connector=connector,
+                                     cookie_jar=aiohttp.DummyCookieJar(),
+                                     trace_configs=[trace_config()]) as session:
+        tasks = set()
+        for host in hosts:
+            await semaphore.acquire()
+            task = asyncio.ensure_future(run(host))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.wait(tasks)
+# end scan
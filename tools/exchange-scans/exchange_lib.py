@@ -2,121 +2,607 @@
 #
 # SPDX-License-Identifier: MIT
 
+import bisect
+import functools
+import http.cookiejar
 import re
 import requests
 import sys
+import threading
+import time
+import urllib3
 
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
 requests.packages.urllib3.disable_warnings(InsecureRequestWarning)
 
-def get_exchange_version(host, timeout: int, scheme='https', debug=False):
-    '''get_exchange_version: Try to determine the version of a Microsoft
-          Exchange installation. Two methods are tried: 
+# Patch levels fixing a CVE, per Exchange version (major, minor). Each
+# entry maps the build of a cumulative update (CU) to the revision of
+# the first security update fixing the CVE on that CU, or to "None" if
+# the CU itself is not affected. CUs older than the first listed one
+# are vulnerable, CUs newer than the last listed one are not affected.
+# Exchange versions which are not listed cannot be classified.
+CVE_FIXES = {
+  'cve-2021-34473' : { # April 2021 security updates
+    (15, 2) : {792 : 13, 858 : 10, 922 : None},   # Exchange 2019
+    (15, 1) : {2176 : 12, 2242 : 8, 2308 : None}, # Exchange 2016
+    (15, 0) : {1497 : 15},                        # Exchange 2013
+  },
+  'cve-2021-33766' : { # July 2021 security updates
+    (15, 2) : {858 : 15, 922 : 13},               # Exchange 2019
+    (15, 1) : {2242 : 12, 2308 : 14},             # Exchange 2016
+    (15, 0) : {1497 : 23},                        # Exchange 2013
+  },
+}
+
+def compile_rules(cve_fixes: dict):
+    '''compile_rules: Turn the patch levels in CVE_FIXES into sorted
+          interval tables which can be searched with bisect.
+        Arguments:
+          cve_fixes (dict) : Patch levels in the format of CVE_FIXES.
+        Return values:
+          rules (dict) : Maps each CVE and Exchange version (major,
+                         minor) to a tuple of two lists: the builds at
+                         which an interval starts and whether builds
+                         in that interval are vulnerable.
+    '''
+    rules = {}
+    for cve, products in cve_fixes.items():
+        for (major, minor), fixes in products.items():
+            starts = [(major, minor, 0, 0)]
+            vulnerable = [True]
+            for cu in sorted(fixes):
+                su = fixes[cu]
+                starts.append((major, minor, cu, 0))
+                vulnerable.append(su is not None)
+                if su is not None:
+                    starts.append((major, minor, cu, su))
+                    vulnerable.append(False)
+            starts.append((major, minor, max(fixes) + 1, 0))
+            vulnerable.append(False)
+            rules[(cve, major, minor)] = (starts, vulnerable)
+    return rules
+# end compile_rules
+
+RULES = compile_rules(CVE_FIXES)
+
+@functools.lru_cache(maxsize=None)
+def parse_version(version: str):
+    '''parse_version: Split a version string like "15.2.922.13"
+          into a tuple of integers.
+        Arguments:
+          version (str) : The version string.
+        Return values:
+          build (tuple) : The parsed version or "None" if it cannot
+                          be parsed.
+    '''
+    try:
+        return tuple(int(part) for part in version.split('.'))
+    except (AttributeError, ValueError):
+        return None
+# end parse_version
+
+def classify_version(version: str, cves=None):
+    '''classify_version: Look up whether an Exchange version is
+          vulnerable to CVEs with a patch level in CVE_FIXES. A version
+          without a security update revision, e.g. "15.2.922" from
+          OWA, is only classified if all updates of its CU share the
+          same status.
+        Arguments:
+          version (str) : The version as returned by
+                          get_exchange_version.
+          cves (list)   : The CVEs to classify the version for.
+                          Default: All CVEs in CVE_FIXES.
+        Return values:
+          status (dict) : Maps each CVE to "True" if the version is
+                          vulnerable, "False" if it is not and "None"
+                          if it cannot be determined.
+    '''
+    if cves is None:
+        cves = CVE_FIXES.keys()
+    build = parse_version(version) if version else None
+    status = {}
+    for cve in cves:
+        status[cve] = None
+        if build is None or len(build) < 3:
+            continue
+        try:
+            starts, vulnerable = RULES[(cve, build[0], build[1])]
+        except KeyError:
+            continue
+        if len(build) == 3:
+            first = vulnerable[bisect.bisect_right(starts, build + (0,)) - 1]
+            last = vulnerable[bisect.bisect_right(starts, build + (sys.maxsize,)) - 1]
+            if first == last:
+                status[cve] = first
+        else:
+            status[cve] = vulnerable[bisect.bisect_right(starts, build[:4]) - 1]
+    return status
+# end classify_version
+
+AUTODISCOVER_PATH = '/autodiscover/autodiscover.xml'
+OWA_PATH = '/owa/'
+OWA_VERSION_REGEX = re.compile(b'href="/owa/(auth/)?(?P<version>[14568][45]?\.[0-9\.]+)/.*"')
+# The version is in the <head> of the OWA login page, so only its start
+# is read instead of downloading the whole page.
+OWA_MAX_BYTES = 128 * 1024
+OWA_CHUNK_SIZE = 8192
+FINGERPRINT_HEADERS = {
+  'Accept-Encoding': 'gzip, deflate',
+  'Accept': '*/*',
+  'Connection': 'keep-alive',
+  'User-Agent' : 'get_exchange_version',
+}
+
+# Requests sent by the checks which need more than the version
+PROBES = {
+  'cve-2021-26855' : {
+    'method' : 'GET',
+    'path' : '/owa/auth/x.js',
+    'headers' : {
+      'Accept-Encoding': 'gzip, deflate',
+      'Accept': '*/*',
+      'Connection': 'keep-alive',
+      'User-Agent' : 'Check for CVE-2021-26855',
+      'Cookie' : 'X-AnonResource=true; X-AnonResource-Backend=localhost/ecp/default.flt?~3; X-BEResource=localhost/owa/auth/logon.aspx?~3;',
+    },
+  },
+  'cve-2021-34473' : {
+    'method' : 'GET',
+    'path' : '/autodiscover/autodiscover.json?@test.com/owa/?&Email=autodiscover/autodiscover.json%3F@test.com',
+    'headers' : {
+      'User-Agent' : 'Check for CVE-2021-34473',
+    },
+  },
+}
+
+_local = threading.local()
+
+def empty_fingerprint(host):
+    '''empty_fingerprint: The fingerprint of a host nothing is known
+          about yet, see get_fingerprint.
+        Arguments:
+          host (str) : The host.
+        Return values:
+          fingerprint (dict) : The fingerprint.
+    '''
+    return {
+      'host' : host,
+      'version' : None,
+      'version_source' : None,
+      'reachable' : False,
+      'status_codes' : {},
+      'headers' : {},
+      'requests' : [],
+      'elapsed' : None,
+    }
+# end empty_fingerprint
+
+def new_request_record(path: str):
+    '''new_request_record: The record of a single request, as stored
+          in the "requests" list of a fingerprint. All times are in
+          seconds: "connect" is the TCP connect, "tls" the TLS
+          handshake, both "None" if an open connection was reused,
+          "first_byte" the time from sending the request to receiving
+          the response headers and "total" the time for the whole
+          request. "error" is the class name of the exception, if the
+          request failed.
+        Arguments:
+          path (str) : The requested path.
+        Return values:
+          record (dict) : The record.
+    '''
+    return {
+      'path' : path,
+      'status' : None,
+      'error' : None,
+      'connect' : None,
+      'tls' : None,
+      'first_byte' : None,
+      'total' : None,
+    }
+# end new_request_record
+
+class TimedHTTPConnection(urllib3.connection.HTTPConnection):
+    '''TimedHTTPConnection: Records how long opening the connection
+          took in the current request record of the thread.
+    '''
+    def _new_conn(self):
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        record = getattr(_local, 'record', None)
+        if record is not None:
+            record['connect'] = time.perf_counter() - start
+        return sock
+# end TimedHTTPConnection
+
+class TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    '''TimedHTTPSConnection: Records how long opening the connection
+          and the TLS handshake took in the current request record of
+          the thread.
+    '''
+    def _new_conn(self):
+        start = time.perf_counter()
+        sock = super()._new_conn()
+        record = getattr(_local, 'record', None)
+        if record is not None:
+            record['connect'] = time.perf_counter() - start
+        return sock
+
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        record = getattr(_local, 'record', None)
+        if record is not None and record['connect'] is not None:
+            record['tls'] = time.perf_counter() - start - record['connect']
+# end TimedHTTPSConnection
+
+class TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+def error_class(e: Exception):
+    '''error_class: Name the cause of a failed request. requests and
+          urllib3 wrap the actual error, e.g. a refused connection or
+          failed name resolution, so the innermost cause is used.
+        Arguments:
+          e (Exception) : The exception raised by the request.
+        Return values:
+          name (str) : The class name of the cause.
+    '''
+    cause = e
+    while True:
+        inner = getattr(cause, 'reason', None)
+        if not isinstance(inner, Exception):
+            inner = next((arg for arg in cause.args
+                          if isinstance(arg, Exception)), None)
+        if isinstance(getattr(inner, 'reason', None), Exception):
+            inner = inner.reason
+        if inner is None:
+            inner = cause.__cause__ or cause.__context__
+        if inner is None or inner is cause:
+            return type(cause).__name__
+        cause = inner
+# end error_class
+
+def timed_request(session, fingerprint, path: str, method: str, url: str,
+                  **kwargs):
+    '''timed_request: Send a request with a session from get_session
+          and append its record to the "requests" of the fingerprint.
+        Arguments:
+          session (requests.Session) : The session to use.
+          fingerprint (dict) : The fingerprint of the host.
+          path (str)    : The requested path, used in the record.
+          method (str)  : The HTTP method.
+          url (str)     : The URL.
+          **kwargs      : Passed on to session.request.
+        Return values:
+          response (requests.Response) : The response. Exceptions are
+                          raised after recording them.
+    '''
+    record = new_request_record(path)
+    fingerprint['requests'].append(record)
+    _local.record = record
+    start = time.perf_counter()
+    try:
+        response = session.request(method, url, **kwargs)
+    except Exception as e:
+        record['error'] = error_class(e)
+        raise
+    finally:
+        record['total'] = time.perf_counter() - start
+        _local.record = None
+    record['status'] = response.status_code
+    record['first_byte'] = (response.elapsed.total_seconds()
+                            - (record['connect'] or 0)
+                            - (record['tls'] or 0))
+    return response
+# end timed_request
+
+def search_chunk(regex, tail: bytes, chunk: bytes):
+    '''search_chunk: Search a regex over a body read in chunks. The
+          regex must not match across lines. The unfinished last line
+          is carried over to the next chunk from the first "href=" in
+          it, so a match split between two chunks is still found
+          without searching the same data again and again.
+        Arguments:
+          regex (re.Pattern) : The compiled regex, e.g.
+                          OWA_VERSION_REGEX.
+          tail (bytes)  : The tail returned for the previous chunk,
+                          b'' for the first one.
+          chunk (bytes) : The next chunk of the body.
+        Return values:
+          (match, tail) (tuple): The match or "None" and the tail to
+                          pass with the next chunk.
+    '''
+    data = tail + chunk
+    match = regex.search(data)
+    if match:
+        return (match, b'')
+    tail = data[data.rfind(b'\n') + 1:]
+    start = tail.find(b'href=')
+    return (None, tail[start:] if start >= 0 else tail[-4:])
+# end search_chunk
+
+def search_response(response, regex, max_bytes=OWA_MAX_BYTES,
+                    chunk_size=OWA_CHUNK_SIZE):
+    '''search_response: Read a streamed response in chunks until the
+          regex matches or max_bytes have been read. If the body has
+          not been read completely, the connection is closed instead
+          of downloading the rest of it, otherwise it is kept for the
+          next request.
+        Arguments:
+          response (requests.Response) : The response, requested with
+                          "stream=True".
+          regex (re.Pattern) : The compiled regex, see search_chunk.
+          max_bytes (int)  : Max number of (decoded) bytes to read.
+                             Default: OWA_MAX_BYTES
+          chunk_size (int) : Default: OWA_CHUNK_SIZE
+        Return values:
+          match (re.Match) : The match or "None".
+    '''
+    match = None
+    tail = b''
+    read = 0
+    drained = False
+    try:
+        for chunk in response.iter_content(chunk_size):
+            match, tail = search_chunk(regex, tail, chunk)
+            read += len(chunk)
+            if match or read >= max_bytes:
+                break
+        else:
+            drained = True
+    finally:
+        # Chunked responses have no length_remaining, so the body only
+        # counts as read if the stream ended or urllib3 reports it done.
+        raw = response.raw
+        if (drained or getattr(raw, 'length_remaining', None) == 0
+                or raw.isclosed()):
+            raw.release_conn()
+        else:
+            response.close()
+    return match
+# end search_response
+
+def get_session():
+    '''get_session: Get the keep-alive session of the current thread,
+          so all requests a thread makes to a host share one
+          connection and TLS handshake. Each session only keeps a
+          single connection to the last host it talked to, i.e. a
+          scan with N threads holds at most N open connections.
+          Cookies are never stored, so checks don't influence each
+          other.
+        Return values:
+          session (requests.Session) : The session of this thread.
+    '''
+    session = getattr(_local, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.verify = False
+        session.cookies.set_policy(
+            http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1,
+                                                pool_maxsize=1)
+        adapter.poolmanager.pool_classes_by_scheme = {
+          'http' : TimedHTTPConnectionPool,
+          'https' : TimedHTTPSConnectionPool,
+        }
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _local.session = session
+    return session
+# end get_session
+
+def get_fingerprint(host, timeout: int, scheme='https://', session=None,
+                    debug=False):
+    '''get_fingerprint: Collect everything the CVE checks need to know
+          about a host in one pass, most importantly the version of
+          the Microsoft Exchange installation. Two methods are tried: 
           1. Get the exact version via the 'X-OWA-Version' header
              from the '/autodiscover/autodiscover.xml' file possible
              since July 2021, see e.g. https://www.msxfaq.de/exchange/update/exchange_build_nummer_ermitteln.htm#analyse_per_autod
           2. Try to parse the version from the HTML return by OWA.
              This has been inspired by the get_exchange_version function in
              https://github.com/cert-lv/CVE-2020-0688/blob/master/lib.py
-             with a more aggressive regex.
+             with a more aggressive regex. Only the first
+             OWA_MAX_BYTES of the page are read.
+          OWA is not tried if the host could not be connected to at
+          all.
          Arguments:
-          host (str)    : The host to get the version from. Can be
-                          either an IP address or a hostname.
+          host (str)    : The host to fingerprint. Can be either an IP
+                          address or a hostname.
           timeout (int) : The timeout for the connection.
           scheme (str)  : The scheme to use, defaults to 'https://'
+          session (requests.Session) : The session to use. Default:
+                          The session of the current thread.
           debug (bool)  : If True, print debugging output do stderr.
         Return values:
-          version (str) : If either method succeeds, the parsed version
-                          is returned, otherwise "None" is returned.
+          fingerprint (dict) : "version" is the parsed version or
+                          "None", "version_source" the method which
+                          found it ("autodiscover" or "owa"),
+                          "reachable" whether the host answered at all,
+                          "status_codes" and "headers" the status
+                          codes and headers of the responses by path.
     '''
-    regex = re.compile(b'href="/owa/(auth/)?(?P<version>[14568][45]?\.[0-9\.]+)/.*"')
-    headers = {
-      'Accept-Encoding': 'gzip, deflate',
-      'Accept': '*/*',
-      'Connection': 'keep-alive',
-      'User-Agent' : 'get_exchange_version',
-    }
-    session = requests.session()
-    session.headers = headers
-    session.verify = False
+    fingerprint = empty_fingerprint(host)
+    if session is None:
+        session = get_session()
     try:
-        auto_path = '/autodiscover/autodiscover.xml'
+        auto_path = AUTODISCOVER_PATH
         auto_url = scheme + host + auto_path
         if debug:
             print(f'Requesting autodiscover URL "{auto_url}"',
                   file=sys.stderr)
-        resp = session.get(auto_url)
+        resp = timed_request(session, fingerprint, auto_path, 'GET',
+                             auto_url, headers=FINGERPRINT_HEADERS,
+                             timeout=timeout, verify=False)
+        fingerprint['reachable'] = True
+        fingerprint['status_codes'][auto_path] = resp.status_code
+        fingerprint['headers'][auto_path] = dict(resp.headers)
         try:
-            return resp.headers['X-OWA-Version']
+            fingerprint['version'] = resp.headers['X-OWA-Version']
+            fingerprint['version_source'] = 'autodiscover'
+            return fingerprint
         except KeyError:
             if debug:
                 print(f'{auto_url}: No "X-OWA-Version" header.',
                       file=sys.stderr)
+    except (requests.exceptions.ConnectionError,
+            requests.exceptions.Timeout) as e:
+        if debug:
+            print(f'Failed to connect to {host}: {e}', file=sys.stderr)
+        return fingerprint
     except Exception as e:
         if debug:
             print(f'Failed to parse version via autodiscover: {e}',
                   file=sys.stderr)
     try:
-        owa_path = '/owa/'
+        owa_path = OWA_PATH
         owa_url = scheme + host + owa_path
         if debug:
             print(f'Requesting OWA "{owa_url}"', file=sys.stderr)
-        resp = requests.get(owa_url, timeout=timeout, verify=False)
-        for line in resp.iter_lines():
-            match = regex.search(line)
-            if match:
-                return match.group('version').decode()
+        resp = timed_request(session, fingerprint, owa_path, 'GET',
+                             owa_url, headers=FINGERPRINT_HEADERS,
+                             timeout=timeout, verify=False, stream=True)
+        fingerprint['reachable'] = True
+        fingerprint['status_codes'][owa_path] = resp.status_code
+        fingerprint['headers'][owa_path] = dict(resp.headers)
+        match = search_response(resp, OWA_VERSION_REGEX)
+        if match:
+            fingerprint['version'] = match.group('version').decode()
+            fingerprint['version_source'] = 'owa'
+            return fingerprint
     except Exception as e:
         if debug:
             print(f'Failed to parse version from OWA: {e}',
                   file=sys.stderr)
-    return None
+    return fingerprint
+# end get_fingerprint
+
+def get_exchange_version(host, timeout: int, scheme='https://',
+                         session=None, debug=False):
+    '''get_exchange_version: Try to determine the version of a Microsoft
+          Exchange installation, see get_fingerprint.
+         Arguments:
+          host (str)    : The host to get the version from. Can be
+                          either an IP address or a hostname.
+          timeout (int) : The timeout for the connection.
+          scheme (str)  : The scheme to use, defaults to 'https://'
+          session (requests.Session) : The session to use. Default:
+                          The session of the current thread.
+          debug (bool)  : If True, print debugging output do stderr.
+        Return values:
+          version (str) : If either method succeeds, the parsed version
+                          is returned, otherwise "None" is returned.
+    '''
+    return get_fingerprint(host, timeout, scheme, session=session,
+                           debug=debug)['version']
 # end get_exchange_version
 
+def evaluate_cve_2021_26855(status_code, headers, version):
+    '''evaluate_cve_2021_26855: Classify the response to the
+          CVE-2021-26855 probe. The server is vulnerable if it
+          forwarded the request to the backend given in the cookie.
+        Arguments:
+          status_code (int) : The status code of the probe.
+          headers (dict)    : The case-insensitive response headers.
+          version (str)     : The version of the server or "None".
+        Return values:
+          (status, version) (tuple): See is_vulnerable_to_cve_2021_26855.
+    '''
+    try:
+        target = headers['x-calculatedbetarget']
+    except KeyError:
+        return (False, version)
+    if 'localhost' in target:
+        return (True, version)
+    else:
+        return (False, version)
+# end evaluate_cve_2021_26855
+
+def evaluate_cve_2021_34473(status_code, headers, version):
+    '''evaluate_cve_2021_34473: Classify the response to the
+          CVE-2021-34473 probe. Versions with the fix are patched
+          regardless of the response, otherwise the status code
+          decides.
+        Arguments:
+          status_code (int) : The status code of the probe.
+          headers (dict)    : The case-insensitive response headers.
+          version (str)     : The version of the server or "None".
+        Return values:
+          (status, version) (tuple): See is_vulnerable_to_cve_2021_34473.
+    '''
+    if classify_version(version, ['cve-2021-34473'])['cve-2021-34473'] == False:
+        return (False, version)
+    if status_code == 302:
+        return (True, version)
+    elif status_code == 400:
+        return (False, version)
+    else:
+        return (None, version)
+# end evaluate_cve_2021_34473
+
+def evaluate_cve_2021_33766(status_code, headers, version):
+    '''evaluate_cve_2021_33766: Classify a server by its version only,
+          as no probe is sent for CVE-2021-33766.
+        Arguments:
+          status_code (int) : Not used.
+          headers (dict)    : Not used.
+          version (str)     : The version of the server or "None".
+        Return values:
+          (status, version) (tuple): See is_vulnerable_to_cve_2021_33766.
+    '''
+    if not version:
+        return (None, None)
+    return (classify_version(version, ['cve-2021-33766'])['cve-2021-33766'],
+            version)
+# end evaluate_cve_2021_33766
+
+EVALUATORS = {
+  'cve-2021-26855' : evaluate_cve_2021_26855,
+  'cve-2021-34473' : evaluate_cve_2021_34473,
+  'cve-2021-33766' : evaluate_cve_2021_33766,
+}
+
 def is_vulnerable_to_cve_2021_26855(host, timeout=5, method='GET',
-                  scheme='https://', path='/owa/auth/x.js',
-                  debug=False):
+                  scheme='https://', path=PROBES['cve-2021-26855']['path'],
+                  fingerprint=None, session=None, debug=False):
     '''is_vulnerable_to_csv_2021_26855: Function to check Exchange
           Servers for being vulnerable to CVE-2021-26855 inpired by
           https://github.com/microsoft/CSS-Exchange/blob/main/Security/src/http-vuln-cve2021-26855.nse
     '''
-    header = {
-      'Accept-Encoding': 'gzip, deflate',
-      'Accept': '*/*',
-      'Connection': 'keep-alive',
-      'User-Agent' : 'Check for CVE-2021-26855',
-      'Cookie' : 'X-AnonResource=true; X-AnonResource-Backend=localhost/ecp/default.flt?~3; X-BEResource=localhost/owa/auth/logon.aspx?~3;',
-    }
+    if session is None:
+        session = get_session()
+    if fingerprint is None:
+        if debug:
+            print('Trying to determine version...', file=sys.stderr)
+        fingerprint = get_fingerprint(host, timeout, scheme, session=session,
+                                      debug=debug)
+    version = fingerprint['version']
     url = scheme + host + path
     try: 
         if debug:
             print(f'Requesting "{url}"', file=sys.stderr)
-        response = requests.request(method, url, headers=header,
-                                    verify=False,timeout=timeout,
-                                    allow_redirects=False)
+        response = timed_request(session, fingerprint, path, method, url,
+                                 headers=PROBES['cve-2021-26855']['headers'],
+                                 verify=False,timeout=timeout,
+                                 allow_redirects=False)
     except Exception as e:
         if debug:
             print(f'Request to {url} failed with {e}', file=sys.stderr)
         return (None, None)
-    if debug:
-        print('Trying to determine version...', file=sys.stderr)
-    version = get_exchange_version(host, timeout, scheme, debug=debug)
     if debug:
         print(f'{host}: {response.status_code} -- {version}',
               file=sys.stderr)
-    try:
-        target = response.headers['x-calculatedbetarget']
-    except KeyError:
-        return (False, version)
-    if 'localhost' in target:
-        return (True, version)
-    else:
-        return (False, version)
+    return evaluate_cve_2021_26855(response.status_code, response.headers,
+                                   version)
 # end is_vulnerable_to_cve_2021_26855
 
 def is_vulnerable_to_cve_2021_34473(host, timeout=5, method='GET', 
-                  scheme='https://', path='/autodiscover/autodiscover.json?@test.com/owa/?&Email=autodiscover/autodiscover.json%3F@test.com',
-                  debug=False):
+                  scheme='https://', path=PROBES['cve-2021-34473']['path'],
+                  fingerprint=None, session=None, debug=False):
     '''is_vulnerable_to_csv_2021_34473: Function to check Exchange
           Servers for being vulnerable to CVE-2021-34473 inspired by
           https://github.com/GossiTheDog/scanning/blob/main/http-vuln-exchange-proxyshell.nse
@@ -124,7 +610,9 @@ def is_vulnerable_to_cve_2021_34473(host, timeout=5, method='GET',
             - Doesn't do reverse lookups on IP addresses, i.e. if
               access is only possible via a hostname it may result in
               false negatives when an IP address is scanned. The nmap
-              script doesn't suffer from this flaw.
+              script doesn't suffer from this flaw. scan.py does the
+              reverse lookups when preparing the host list, see
+              hostlist.prepare_hosts.
             - Only tries one scheme and not automatically 'https://'
               and 'http://'. The namp script doesn't suffer
               from this limitation.
@@ -138,6 +626,10 @@ def is_vulnerable_to_cve_2021_34473(host, timeout=5, method='GET',
           path (str)    : The path on the server to access. The
                           default is the path from the original nmap
                           script.
+          fingerprint (dict) : The result of get_fingerprint for the
+                          host. It is collected if not given.
+          session (requests.Session) : The session to use. Default:
+                          The session of the current thread.
           debug (bool)  : If True, print debugging output do stderr.
         Return values:
           (status, version) (tuple): "status" is a bool if it could
@@ -146,63 +638,36 @@ def is_vulnerable_to_cve_2021_34473(host, timeout=5, method='GET',
                         is the value returned from get_exchange_version
                         or "None" if the request to the host failed.
     '''
-    header = {
-      'User-Agent' : 'Check for CVE-2021-34473',
-    }
+    if session is None:
+        session = get_session()
+    if fingerprint is None:
+        if debug:
+            print('Trying to determine version...', file=sys.stderr)
+        fingerprint = get_fingerprint(host, timeout, scheme, session=session,
+                                      debug=debug)
+    version = fingerprint['version']
     url = scheme + host + path
     try: 
         if debug:
             print(f'Requesting "{url}"', file=sys.stderr)
-        response = requests.request(method, url, headers=header,
-                                    verify=False,timeout=timeout,
-                                    allow_redirects=False)
+        response = timed_request(session, fingerprint, path, method, url,
+                                 headers=PROBES['cve-2021-34473']['headers'],
+                                 verify=False,timeout=timeout,
+                                 allow_redirects=False)
     except Exception as e:
         if debug:
             print(f'Request to {url} failed with {e}', file=sys.stderr)
         return (None, None)
-    if debug:
-        print('Trying to determine version...', file=sys.stderr)
-    version = get_exchange_version(host, timeout, scheme, debug=debug)
-    if version:
-        parts = version.split('.')
-        major = int(parts[0])
-        minor = int(parts[1])
-        cu = int(parts[2])
-        try: 
-            su = int(parts[3])
-        except IndexError:
-            su = 0
-        if major == 15 and minor == 2: # Exchange 2019
-            if cu >= 922: # CU10 and above are not affected
-                return (False, version)
-            elif cu == 858 and su >= 10: # CU9, SU from April 2021 or later
-                return (False, version)
-            elif cu == 792 and su >= 13: # CU8, SU from April 2021 or later
-                return (False, version) 
-        elif major == 15 and minor == 1: # Exchange 2016
-            if cu >= 2308: # CU21 and above are not affected
-                return (False, version)
-            elif cu == 2242 and su >= 8: # CU20, SU from April 2021 or later
-                return (False, version)
-            elif cu == 2176 and su >= 12: # CU19, SU from April 2021 or later
-                return (False, version)
-        elif major == 15 and minor == 0: # Exchange 2013
-            if cu == 1497 and su >= 15: # CU23, SU from April 2021 or later
-                return (False, version)
     if debug:
         print(f'{host}: {response.status_code} -- {version}',
               file=sys.stderr)
-    if response.status_code == 302:
-        return (True, version)
-    elif response.status_code == 400:
-        return (False, version)
-    else:
-        return (None, version)
+    return evaluate_cve_2021_34473(response.status_code, response.headers,
+                                   version)
 # end is_vulnerable_to_cve_2021_34473
 
 def is_vulnerable_to_cve_2021_33766(host, timeout=5, method='POST',
                   scheme='https://', path='/ecp/postmaster@{}/RulesEditor/InboxRules.svc/NewObject',
-                  debug=False):
+                  fingerprint=None, session=None, debug=False):
     '''is_vulnerable_to_cve_2021_33766: Checks if an Exchange
           installation is vulnerable to CVE-2021-33766. For a detailed
           description of the vulnerability see
@@ -218,6 +683,10 @@ def is_vulnerable_to_cve_2021_33766(host, timeout=5, method='POST',
           scheme (str)  : The scheme to use. Default: "https://"
           path (str)    : The path on the server to access. This
                           argument is currently not used.
+          fingerprint (dict) : The result of get_fingerprint for the
+                          host. It is collected if not given.
+          session (requests.Session) : The session to use. Default:
+                          The session of the current thread.
           debug (bool)  : If True, print debugging output do stderr.
         Return values:
           (status, version) (tuple): "status" is a bool if it could
@@ -226,64 +695,66 @@ def is_vulnerable_to_cve_2021_33766(host, timeout=5, method='POST',
                         is the value returned from get_exchange_version
                         or "None" if the request to the host failed.
     '''
-    if debug:
-        this = is_vulnerable_to_cve_2021_33766
-    header = {
-      'User-Agent'  : 'Check for CVE-2021-33766',
-      'Cookie'      : 'SecurityToken=x',
-    }
     if debug:
         print('Trying to determine version...', file=sys.stderr)
-    version = get_exchange_version(host, timeout, scheme, debug=debug)
+    if fingerprint is None:
+        fingerprint = get_fingerprint(host, timeout, scheme, session=session,
+                                      debug=debug)
+    version = fingerprint['version']
     if debug:
         print(f'Version found: "{version}"')
-    if version:
-        parts = version.split('.')
-        major = int(parts[0])
-        minor = int(parts[1])
-        cu = int(parts[2])
-        try: 
-            su = int(parts[3])
-        except IndexError:
-            su = None
-        if major == 15 and minor == 2: # Exchange 2019
-            if cu <= 792: # CU8 and below are vulnerable
-                return (True, version) 
-            elif cu > 922: #CU11 and later -- not released at time of writing (2021-09-03)
-                return (False, version)
-            elif su:
-                if cu == 922: # CU10
-                    if su >= 13: # SU from July 2021 or later
-                        return (False, version)
-                    else:
-                        return (True, version)
-                elif cu == 858 and su >= 15: # CU9
-                    if su >= 15: # SU from July 2021 or later
-                        return (False, version)
-                    else:
-                        return (True, version)
-        elif major == 15 and minor == 1: # Exchange 2016
-            if cu > 2308: # CU22 and later -- not released at time of writing (2021-09-03)
-                return (False, version)
-            elif cu < 2242: # CU 19 and below are vulnerable
-                return (True, version)
-            elif su:
-                if cu == 2242: # CU20
-                    if su >= 12: # SU from July 2021 or later
-                        return (False, version)
-                    else:
-                        return (True, version)
-        elif major == 15 and minor == 0: # Exchange 2013
-            if cu < 1497: # CU22 and below are vulnerable
-                return (True, version)
-            elif su:
-                if cu == 1497: # CU23
-                    if su >= 23: # SU from July 2021 or later
-                        return (False, version)
-                    else:
-                        return (True, version)
-        else:
-            return (None, version)
-    else:
-        return (None, None)
+    return evaluate_cve_2021_33766(None, None, version)
 # end is_vulnerable_to_cve_2021_33766
+
+CHECKS = {
+  'cve-2021-26855' : is_vulnerable_to_cve_2021_26855,
+  'cve-2021-34473' : is_vulnerable_to_cve_2021_34473,
+  'cve-2021-33766' : is_vulnerable_to_cve_2021_33766,
+}
+
+def check_host(host, cves: list, timeout=5, scheme='https://',
+               method=None, path=None, session=None, debug=False):
+    '''check_host: Check a host for several CVEs. The host is
+          fingerprinted once and all checks share the result, so the
+          version is only requested once per host. Checks are skipped
+          if the host cannot be connected to.
+        Arguments:
+          host (str)    : The host to check. Can be an IP address or
+                          a hostname.
+          cves (list)   : The CVEs to check for, keys of CHECKS.
+          timeout (int) : The timeout for each request in seconds.
+                          Default: 5
+          scheme (str)  : The scheme to use. Default: "https://"
+          method (str)  : The HTTP method to use. Default: The
+                          default of each check.
+          path (str)    : The path on the server to access. Default:
+                          The default of each check.
+          session (requests.Session) : The session to use. Default:
+                          The session of the current thread.
+          debug (bool)  : If True, print debugging output do stderr.
+        Return values:
+          (fingerprint, results) (tuple): "fingerprint" is the result
+                          of get_fingerprint, "results" maps each CVE
+                          to the (status, version) tuple of its check.
+    '''
+    start = time.perf_counter()
+    if session is None:
+        session = get_session()
+    fingerprint = get_fingerprint(host, timeout, scheme, session=session,
+                                  debug=debug)
+    results = {}
+    for cve in cves:
+        if not fingerprint['reachable']:
+            results[cve] = (None, None)
+            continue
+        kwargs = {}
+        if method:
+            kwargs['method'] = method
+        if path:
+            kwargs['path'] = path
+        results[cve] = CHECKS[cve](host, timeout, scheme=scheme,
+                                   fingerprint=fingerprint,
+                                   session=session, debug=debug, **kwargs)
+    fingerprint['elapsed'] = time.perf_counter() - start
+    return (fingerprint, results)
+# end check_host
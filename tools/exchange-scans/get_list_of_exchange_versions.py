@@ -3,10 +3,18 @@
 # SPDX-License-Identifier: MIT
 
 import bs4
+import datetime
+import json
+import os
 import pandas
 import requests
 import sys
 
+DEFAULT_URL = 'https://docs.microsoft.com/en-us/exchange/new-features/build-numbers-and-release-dates'
+DEFAULT_DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                'exchange_versions.json')
+DATABASE_FORMAT = 1
+
 def get_soup(url: str, headers: dict, timeout=2, debug=False):
     '''get_soup: Get the HTML content of a website and parse it into
         a bs4.BeautifulSoup object.
@@ -161,15 +169,257 @@ def combine_dicts(dictlist: list, direction: str, debug=False):
     return mappings
 # end combine_dicts
     
+
+def get_version_entries(table_as_list: list, debug=False):
+    '''get_version_entries: Convert the rows of one build number
+        table into database entries. Older Exchange versions only list
+        a single build number, in which case the long build number is
+        left empty.
+      Arguments:
+        table_as_list (list): An HTML table parsed into a list of
+          lists, each sublist containing one row of the table.
+        debug (bool) : If True, print debug output.
+      Return values:
+        entries (list) : One dict per row with the keys "name",
+          "release_date", "build_short" and "build_long".
+    '''
+    entries = []
+    for entry in table_as_list:
+        if len(entry) < 3:
+            continue
+        entries.append({
+          'name' : entry[0],
+          'release_date' : entry[1],
+          'build_short' : entry[2],
+          'build_long' : entry[3] if len(entry) > 3 else '',
+        })
+    if debug:
+        print(f'Resulting entries: "{entries}"', file=sys.stderr)
+    return entries
+# end get_version_entries
+
+def fetch_database(url=DEFAULT_URL, headers=None, timeout=2, debug=False):
+    '''fetch_database: Download the list of Exchange build numbers
+        and convert it into the on-disk database format.
+      Arguments:
+        url (str)     : The URL to download the list from.
+        headers (dict): The headers to use for the request.
+        timeout (int) : The timeout for the request in seconds.
+                        Default: 2
+        debug (bool)  : If True, print debug output.
+      Return values:
+        database (dict) : The database or "None" if the download or
+          parsing failed.
+    '''
+    if headers is None:
+        headers = {'User-Agent' : 'get_list_of_exchange_versions'}
+    soup = get_soup(url, headers, timeout=timeout, debug=debug)
+    if soup is None:
+        return None
+    tables = get_tables(soup, debug=debug)
+    if not tables:
+        return None
+    versions = []
+    for table in tables:
+        rows = get_table_rows(table, debug=debug)
+        versions.extend(get_version_entries(rows, debug=debug))
+    return {
+      'format' : DATABASE_FORMAT,
+      'generated' : datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+      'source' : url,
+      'versions' : versions,
+    }
+# end fetch_database
+
+def save_database(database: dict, path=DEFAULT_DATABASE):
+    '''save_database: Write the database to disk. The file is
+        written next to its final location first and then renamed,
+        so a failed refresh never leaves a truncated database behind.
+      Arguments:
+        database (dict) : The database as returned by fetch_database.
+        path (str)      : Where to write the database to.
+    '''
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(database, f, indent=1)
+        f.write('\n')
+    os.replace(tmp_path, path)
+# end save_database
+
+def load_database(path=DEFAULT_DATABASE, debug=False):
+    '''load_database: Read the database from disk.
+      Arguments:
+        path (str)   : The file to read the database from.
+        debug (bool) : If True, print debug output.
+      Return values:
+        database (dict) : The database or "None" if the file does not
+          exist, cannot be parsed or was written in another format.
+    '''
+    try:
+        with open(path) as f:
+            database = json.load(f)
+    except (OSError, ValueError) as e:
+        if debug:
+            print(f'[-] Failed to load "{path}": {e}', file=sys.stderr)
+        return None
+    if database.get('format') != DATABASE_FORMAT:
+        if debug:
+            print(f'[-] "{path}" has unsupported format'
+                  f' {database.get("format")}', file=sys.stderr)
+        return None
+    if debug:
+        print(f'Loaded {len(database["versions"])} versions generated'
+              f' {database["generated"]} from "{path}"', file=sys.stderr)
+    return database
+# end load_database
+
+def get_database(path=DEFAULT_DATABASE, refresh=False, url=DEFAULT_URL,
+                 headers=None, timeout=2, debug=False):
+    '''get_database: Load the database from disk. Only if "refresh"
+        is set, the list is downloaded again and the file on disk
+        is replaced. If the download fails, e.g. when offline or if
+        the layout of the page changed, the database on disk is used
+        with a warning.
+      Arguments:
+        path (str)     : The database file.
+        refresh (bool) : If True, download the list and update the
+                         database file before returning it.
+        url (str)      : The URL to download the list from.
+        headers (dict) : The headers to use for the download.
+        timeout (int)  : The timeout for the download in seconds.
+        debug (bool)   : If True, print debug output.
+      Return values:
+        database (dict) : The database or "None" if it is not
+          available.
+    '''
+    if refresh:
+        database = fetch_database(url, headers, timeout=timeout,
+                                  debug=debug)
+        if database and database['versions']:
+            save_database(database, path)
+            print(f'Wrote {len(database["versions"])} versions to "{path}"',
+                  file=sys.stderr)
+            return database
+        print(f'[-] Failed to download the versions from "{url}",'
+              f' using "{path}" instead.', file=sys.stderr)
+    return load_database(path, debug=debug)
+# end get_database
+
+def database_to_mapping(database: dict, direction: str):
+    '''database_to_mapping: Create the same dictionaries as
+        combine_dicts from a loaded database.
+      Arguments:
+        database (dict) : The database as returned by load_database.
+        direction (str) : Whether the resulting dict should map
+                          names to version strings or vice versa.
+      Return values:
+        mapping (dict) : The resulting dictionary.
+    '''
+    direction = direction.lower()
+    mapping = {}
+    for entry in database['versions']:
+        if direction == 'name_to_number':
+            mapping[entry['name']] = entry['build_short']
+        elif direction == 'number_to_name':
+            mapping[entry['build_short']] = entry['name']
+    return mapping
+# end database_to_mapping
+
+def parse_build_number(version: str):
+    '''parse_build_number: Split a dotted build number into a tuple
+        of integers. Short and long build numbers of the same build,
+        e.g. "15.2.922.13" and "15.02.0922.013", give the same tuple.
+      Arguments:
+        version (str) : The build number.
+      Return values:
+        build (tuple) : The parsed build number or "None" if it
+          is not a dotted list of numbers.
+    '''
+    try:
+        return tuple(int(part) for part in version.strip().split('.'))
+    except (AttributeError, ValueError):
+        return None
+# end parse_build_number
+
+def trim_update_name(name: str):
+    '''trim_update_name: Remove the security update from a product
+        name, e.g. "Exchange Server 2019 CU9 Jul21SU" becomes
+        "Exchange Server 2019 CU9". Names of cumulative updates,
+        previews and RTM versions are returned unchanged.
+      Arguments:
+        name (str) : The product name.
+      Return values:
+        name (str) : The name without the security update.
+    '''
+    name_list = name.split(' ')
+    if name_list[-1].startswith('CU') or name_list[-1] in ['Preview', 'RTM']:
+        return name
+    return ' '.join(name_list[0:len(name_list)-1])
+# end trim_update_name
+
+def build_version_index(database: dict, debug=False):
+    '''build_version_index: Index the product names by every prefix
+        of their parsed build number, so a version of any length can
+        be resolved with a single lookup. Like the list on the build
+        numbers page, the first (i.e. newest) build sharing a prefix
+        wins. Versions with three parts, as found in the OWA HTML,
+        identify a cumulative update only, so their names are
+        trimmed here once instead of on every lookup.
+      Arguments:
+        database (dict) : The database as returned by load_database.
+        debug (bool)    : If True, print debug output.
+      Return values:
+        index (dict) : Maps build number tuples and their prefixes
+          to product names.
+    '''
+    index = {}
+    for entry in database['versions']:
+        for build_number in (entry['build_short'], entry['build_long']):
+            build = parse_build_number(build_number)
+            if build is None:
+                continue
+            for length in range(1, len(build) + 1):
+                prefix = build[:length]
+                if prefix in index:
+                    continue
+                if length == 3:
+                    index[prefix] = trim_update_name(entry['name'])
+                else:
+                    index[prefix] = entry['name']
+    if debug:
+        print(f'Indexed {len(index)} build number prefixes',
+              file=sys.stderr)
+    return index
+# end build_version_index
+
+def lookup_version_name(index: dict, version: str):
+    '''lookup_version_name: Resolve a version string to a product
+        name using an index created by build_version_index.
+      Arguments:
+        index (dict)  : The version index.
+        version (str) : The version, e.g. "15.2.922.13", "15.2.922".
+      Return values:
+        name (str) : The product name or "" if it is unknown.
+    '''
+    build = parse_build_number(version)
+    if build is None:
+        return ''
+    return index.get(build, '')
+# end lookup_version_name
+
             
 if __name__ == '__main__':
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument('--url', '-u',
-                        default='https://docs.microsoft.com/en-us/exchange/new-features/build-numbers-and-release-dates',
+    parser.add_argument('--url', '-u', default=DEFAULT_URL,
                         help='URL to download list of Exchange Server'
-                        ' versions from. Default:'
-                        ' https://docs.microsoft.com/en-us/exchange/new-features/build-numbers-and-release-dates')
+                        f' versions from. Default: {DEFAULT_URL}')
+    parser.add_argument('--database', '-d', default=DEFAULT_DATABASE,
+                        help='JSON file holding the list of Exchange'
+                        f' versions. Default: {DEFAULT_DATABASE}')
+    parser.add_argument('--refresh', '-r', action='store_true',
+                        help='Download the list of Exchange versions and'
+                        ' update the database file.')
     parser.add_argument('--mapping', '-m',
                         choices=['name_to_number', 'number_to_name'],
                         help='Create a dictionary of Exchange versions'
@@ -187,14 +437,17 @@ if __name__ == '__main__':
     headers = {
       'User-Agent' : args.user_agent,
     }
-    soup = get_soup(args.url, headers, timeout=args.timeout,
-                    debug=debug)
-    tables = get_tables(soup, debug=debug)
-    mapping = combine_dicts(tables, args.mapping, debug=debug)
-    print('{')
-    for key, value in mapping.items():
-        print(f'  "{key}" : "{value}",')
-    print('}')
-
-
-
+    database = get_database(args.database, refresh=args.refresh,
+                            url=args.url, headers=headers,
+                            timeout=args.timeout,
+                            debug=debug)
+    if database is None:
+        print(f'[-] No database at "{args.database}", run with'
+              ' --refresh while online first.', file=sys.stderr)
+        sys.exit(1)
+    if args.mapping:
+        mapping = database_to_mapping(database, args.mapping)
+        print('{')
+        for key, value in mapping.items():
+            print(f'  "{key}" : "{value}",')
+        print('}')
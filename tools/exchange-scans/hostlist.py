@@ -0,0 +1,225 @@
+# SPDX-FileCopyrightText: 2021 Dimitri Robl
+#
+# SPDX-License-Identifier: MIT
+
+import concurrent.futures
+import functools
+import ipaddress
+import socket
+import sys
+import urllib.parse
+
+MAX_CIDR_HOSTS = 65536
+RESOLVER_THREADS = 64
+
+def normalize_entry(line: str):
+    '''normalize_entry: Normalize one line of a host list. Comments
+        starting with "#" and blank lines are dropped, URLs are reduced
+        to their host and port, hostnames are lowercased and trailing
+        dots removed.
+      Arguments:
+        line (str) : The line.
+      Return values:
+        (host, port) (tuple): The host, an IP address, a network in
+          CIDR notation or a hostname, and the port or "None".
+          "None" if the line holds no host.
+    '''
+    entry = line.split('#', 1)[0].strip()
+    if not entry:
+        return None
+    if '://' in entry:
+        entry = urllib.parse.urlsplit(entry).netloc
+    if '/' in entry and not _is_network(entry):
+        entry = entry.split('/', 1)[0]
+    port = None
+    if entry.startswith('['):
+        host, _, rest = entry[1:].partition(']')
+        if rest.startswith(':') and rest[1:].isdigit():
+            port = int(rest[1:])
+    elif entry.count(':') == 1:
+        host, _, port_str = entry.partition(':')
+        if port_str.isdigit():
+            port = int(port_str)
+        else:
+            host = entry
+    else:
+        host = entry
+    host = host.rstrip('.').lower()
+    if not host:
+        return None
+    return (host, port)
+# end normalize_entry
+
+def _is_network(entry: str):
+    try:
+        ipaddress.ip_network(entry, strict=False)
+        return True
+    except ValueError:
+        return False
+# end _is_network
+
+def expand_entry(host: str, max_hosts=MAX_CIDR_HOSTS):
+    '''expand_entry: Expand a network in CIDR notation into its host
+        addresses. Other hosts are returned unchanged.
+      Arguments:
+        host (str)      : The host or network.
+        max_hosts (int) : Networks with more addresses are skipped
+                          to avoid scanning far beyond the scope by
+                          a typo. Default: MAX_CIDR_HOSTS
+      Return values:
+        hosts (list) : The hosts.
+    '''
+    if '/' not in host:
+        return [host]
+    try:
+        network = ipaddress.ip_network(host, strict=False)
+    except ValueError:
+        return [host]
+    if network.num_addresses > max_hosts:
+        print(f'[-] Skipping {network}: more than {max_hosts} addresses',
+              file=sys.stderr)
+        return []
+    if network.num_addresses == 1:
+        return [str(network.network_address)]
+    return [str(address) for address in network.hosts()]
+# end expand_entry
+
+@functools.lru_cache(maxsize=None)
+def resolve(name: str):
+    '''resolve: Look up the address of a hostname, preferring IPv4.
+      Arguments:
+        name (str) : The hostname.
+      Return values:
+        address (str) : The address or "None" if it cannot be
+          resolved.
+    '''
+    try:
+        infos = socket.getaddrinfo(name, None, proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        return None
+    infos.sort(key=lambda info: info[0] != socket.AF_INET)
+    return infos[0][4][0] if infos else None
+# end resolve
+
+@functools.lru_cache(maxsize=None)
+def reverse(address: str):
+    '''reverse: Look up the hostname of an address. The name is only
+        returned if it resolves back to the same address, as PTR
+        records can be set to anything by the owner of the network.
+      Arguments:
+        address (str) : The IP address.
+      Return values:
+        name (str) : The hostname or "None".
+    '''
+    try:
+        name = socket.gethostbyaddr(address)[0].rstrip('.').lower()
+    except (socket.herror, socket.gaierror, OSError):
+        return None
+    if resolve(name) != address:
+        return None
+    return name
+# end reverse
+
+def _is_address(host: str):
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+# end _is_address
+
+def _format(host: str, port):
+    if ':' in host:
+        host = f'[{host}]'
+    return host if port is None else f'{host}:{port}'
+# end _format
+
+def prepare_hosts(lines, resolve_names=True, max_cidr_hosts=MAX_CIDR_HOSTS,
+                  threads=RESOLVER_THREADS, debug=False):
+    '''prepare_hosts: Turn a host list into the list of hosts to scan.
+        Entries are normalized and networks expanded. Hostnames are
+        resolved concurrently and all entries pointing at the same
+        address and port are scanned only once. Where possible, a
+        hostname is kept for such a host, as some Exchange servers
+        only answer correctly if the request is sent to their name.
+        For IP addresses listed on their own, the name is taken from
+        a reverse lookup which resolves back to the same address.
+        Addresses from expanded networks are not looked up, as a /16
+        alone would take 65536 reverse lookups before the scan starts.
+      Arguments:
+        lines (iterable)     : The lines of the host list.
+        resolve_names (bool) : If False, only normalize, expand and
+                               remove exact duplicates.
+        max_cidr_hosts (int) : See expand_entry.
+        threads (int)        : Max number of parallel DNS lookups.
+        debug (bool)         : If True, print debug output.
+      Return values:
+        hosts (list) : The hosts in the order of the host list, as
+          "host" or "host:port".
+    '''
+    entries = []
+    seen = set()
+    listed_addresses = set()
+    count = 0
+    for line in lines:
+        normalized = normalize_entry(line)
+        if normalized is None:
+            continue
+        host, port = normalized
+        if _is_address(host):
+            listed_addresses.add(host)
+        for expanded in expand_entry(host, max_cidr_hosts):
+            count += 1
+            if (expanded, port) in seen:
+                continue
+            seen.add((expanded, port))
+            entries.append((expanded, port))
+    if not resolve_names:
+        hosts = [_format(host, port) for host, port in entries]
+        if debug:
+            print(f'{count} entries, {len(hosts)} unique hosts',
+                  file=sys.stderr)
+        return hosts
+
+    names = set(host for host, _ in entries if not _is_address(host))
+    addresses = set(host for host, _ in entries if host in listed_addresses)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=threads) as executor:
+        resolved = dict(zip(names, executor.map(resolve, names)))
+        names_of = dict(zip(addresses, executor.map(reverse, addresses)))
+
+    # Group by address and port. The first hostname from the list names
+    # the group, a name from a reverse lookup is only used if there is none.
+    groups = {}
+    order = []
+    for host, port in entries:
+        if _is_address(host):
+            key = (str(ipaddress.ip_address(host)), port)
+            name = names_of.get(host)
+            listed = False
+        else:
+            address = resolved.get(host)
+            # Unresolvable names are kept, the scan reports them as unknown
+            key = (address, port) if address else (host, port)
+            name = host
+            listed = True
+        group = groups.get(key)
+        if group is None:
+            groups[key] = {'name' : name, 'listed' : listed, 'aliases' : []}
+            order.append(key)
+        elif listed and not group['listed']:
+            group['name'] = name
+            group['listed'] = True
+        elif listed and name != group['name']:
+            group['aliases'].append(name)
+    hosts = []
+    for key in order:
+        address, port = key
+        name = groups[key]['name'] or address
+        hosts.append(_format(name, port))
+        if debug and groups[key]['aliases']:
+            print(f'{name} ({address}) also listed as'
+                  f' {", ".join(groups[key]["aliases"])}', file=sys.stderr)
+    if debug:
+        print(f'{count} entries, {len(hosts)} unique hosts', file=sys.stderr)
+    return hosts
+# end prepare_hosts
@@ -8,110 +8,397 @@ import concurrent.futures
 import datetime
 import exchange_lib
 import get_list_of_exchange_versions as gev
+import hostlist
+import json
+import os
 import sys
+import time
+
+FLUSH_INTERVAL = 5 # seconds
+FLUSH_HOSTS = 100
+STATUS_NAMES = {True : 'vulnerable', False : 'patched', None : 'unknown'}
+
+def load_checkpoint(path: str):
+    '''load_checkpoint: Read the hosts which have been completed
+        in a previous run.
+      Arguments:
+        path (str) : The checkpoint file.
+      Return values:
+        done (set) : The completed hosts, empty if there is no
+                     checkpoint file.
+    '''
+    try:
+        with open(path) as f:
+            return set(line.rstrip('\n') for line in f if line.strip())
+    except FileNotFoundError:
+        return set()
+# end load_checkpoint
+
+def prune_results(path: str, done: set, output_format='csv'):
+    '''prune_results: Remove the rows of hosts which are not in the
+        checkpoint from a results file. These were written by an
+        interrupted run before the host was checkpointed and are
+        written again when the host is scanned again.
+        The summary of a JSON lines file is removed as well, the
+        resumed run writes a new one, and so is a partially written
+        last line.
+      Arguments:
+        path (str) : The results file.
+        done (set) : The completed hosts.
+        output_format (str) : "csv" or "jsonl".
+    '''
+    tmp_path = path + '.tmp'
+    try:
+        with open(path, newline='') as f, open(tmp_path, 'w', newline='') as out:
+            if output_format == 'jsonl':
+                for line in f:
+                    # A crash can leave a partial last line
+                    try:
+                        host = json.loads(line).get('host')
+                    except json.JSONDecodeError:
+                        continue
+                    if host in done and line.endswith('\n'):
+                        out.write(line)
+            else:
+                rows = [row for row in csv.reader(f) if row and row[0] in done]
+                csv.writer(out, dialect='unix').writerows(rows)
+    except FileNotFoundError:
+        return
+    os.replace(tmp_path, path)
+# end prune_results
+
+def percentiles(values: list):
+    '''percentiles: Summarize a list of durations.
+      Arguments:
+        values (list) : The durations in seconds.
+      Return values:
+        summary (dict) : The number of values, the 50th, 90th and
+          99th percentile (nearest rank) and the maximum, rounded to
+          milliseconds.
+    '''
+    if not values:
+        return {'count' : 0}
+    values = sorted(values)
+    summary = {'count' : len(values)}
+    for p in (50, 90, 99):
+        rank = max(0, -(-p * len(values) // 100) - 1)
+        summary[f'p{p}'] = round(values[rank], 3)
+    summary['max'] = round(values[-1], 3)
+    return summary
+# end percentiles
+
+class ScanStats:
+    '''ScanStats: Collects the timings and errors of all requests of
+        a scan to summarize throughput and latency at the end.
+    '''
+    PHASES = ('connect', 'tls', 'first_byte', 'total')
+
+    def __init__(self):
+        self.start = time.monotonic()
+        self.hosts = 0
+        self.reachable = 0
+        self.requests = 0
+        self.errors = {}
+        self.status = {}
+        self.latency = {phase : [] for phase in self.PHASES}
+        self.host_latency = []
+
+    def add(self, fingerprint, results):
+        self.hosts += 1
+        if fingerprint['reachable']:
+            self.reachable += 1
+        if fingerprint['elapsed'] is not None:
+            self.host_latency.append(fingerprint['elapsed'])
+        for request in fingerprint['requests']:
+            self.requests += 1
+            if request['error']:
+                self.errors[request['error']] = self.errors.get(request['error'], 0) + 1
+            for phase in self.PHASES:
+                if request[phase] is not None:
+                    self.latency[phase].append(request[phase])
+        for cve, (status, version) in results.items():
+            counts = self.status.setdefault(cve, {name : 0 for name in STATUS_NAMES.values()})
+            counts[STATUS_NAMES[status]] += 1
+
+    def summary(self):
+        duration = time.monotonic() - self.start
+        latency = {phase : percentiles(values)
+                   for phase, values in self.latency.items()}
+        latency['host'] = percentiles(self.host_latency)
+        return {
+          'hosts' : self.hosts,
+          'reachable' : self.reachable,
+          'requests' : self.requests,
+          'duration' : round(duration, 3),
+          'hosts_per_second' : round(self.hosts / duration, 2) if duration else None,
+          'errors' : self.errors,
+          'status' : self.status,
+          'latency' : latency,
+        }
+# end ScanStats
+
+class ResultWriter:
+    '''ResultWriter: Writes the results of each host to the CSV files,
+        or as one JSON line to the results file, as soon as it is
+        done. JSON lines include the timings of every request and the
+        file ends with a summary of the scan. The files are flushed every
+        FLUSH_INTERVAL seconds or FLUSH_HOSTS hosts. Only after that,
+        the hosts are appended to the checkpoint file, so all results
+        of a checkpointed host are on disk.
+    '''
+    def __init__(self, results: str, patched: str, unknown: str,
+                 checkpoint: str, version_index: dict, timestamp: str,
+                 resume=False, output_format='csv'):
+        mode = 'a' if resume else 'w'
+        self.output_format = output_format
+        self.stats = ScanStats()
+        self.files = []
+        self.writers = {}
+        for status, path in ((True, results), (False, patched),
+                             (None, unknown)):
+            if not path:
+                self.writers[status] = None
+                continue
+            f = sys.stdout if path == '-' else open(path, mode, newline='')
+            self.files.append(f)
+            self.writers[status] = csv.writer(f, dialect='unix')
+        self.results = self.files[0]
+        self.checkpoint = open(checkpoint, mode)
+        self.version_index = version_index
+        self.timestamp = timestamp
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+    def record(self, host, fingerprint, results):
+        self.stats.add(fingerprint, results)
+        if self.output_format == 'jsonl':
+            self.record_json(host, fingerprint, results)
+        else:
+            self.record_csv(host, fingerprint, results)
+        self.pending.append(host)
+        if (len(self.pending) >= FLUSH_HOSTS
+                or time.monotonic() - self.last_flush >= FLUSH_INTERVAL):
+            self.flush()
+
+    def record_csv(self, host, fingerprint, results):
+        for cve, (status, version) in results.items():
+            if version == None:
+                name = ''
+            else:
+                name = gev.lookup_version_name(self.version_index, version)
+            writer = self.writers[status]
+            if writer:
+                writer.writerow([host, self.timestamp, version, name, cve])
+
+    def record_json(self, host, fingerprint, results):
+        version = fingerprint['version']
+        requests = []
+        for request in fingerprint['requests']:
+            requests.append({key : round(value, 4) if isinstance(value, float) else value
+                             for key, value in request.items()})
+        self.results.write(json.dumps({
+          'host' : host,
+          'timestamp' : self.timestamp,
+          'version' : version,
+          'name' : gev.lookup_version_name(self.version_index, version) if version else '',
+          'version_source' : fingerprint['version_source'],
+          'reachable' : fingerprint['reachable'],
+          'elapsed' : round(fingerprint['elapsed'] or 0, 4),
+          'results' : {cve : STATUS_NAMES[status]
+                       for cve, (status, _) in results.items()},
+          'requests' : requests,
+        }) + '\n')
+
+    def flush(self):
+        for f in self.files:
+            f.flush()
+        for host in self.pending:
+            self.checkpoint.write(host + '\n')
+        self.checkpoint.flush()
+        self.pending = []
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        summary = self.stats.summary()
+        if self.output_format == 'jsonl':
+            self.results.write(json.dumps({'summary' : summary}) + '\n')
+        self.flush()
+        for f in self.files:
+            if f is not sys.stdout:
+                f.close()
+        self.checkpoint.close()
+        if self.output_format == 'jsonl':
+            print(f'{summary["hosts"]} hosts in {summary["duration"]}s'
+                  f' ({summary["hosts_per_second"]} hosts/s),'
+                  f' {summary["requests"]} requests, errors: {summary["errors"]}',
+                  file=sys.stderr)
+            for phase, values in summary['latency'].items():
+                print(f'  {phase:10} {values}', file=sys.stderr)
+# end ResultWriter
+
+def scan_threads(hosts, args, on_result):
+    '''scan_threads: Check all hosts in a thread pool.
+      Arguments:
+        hosts (list)   : The hosts to check.
+        args (argparse.Namespace) : The command line arguments.
+        on_result (function) : Called with host, fingerprint and
+                         results as soon as a host is done.
+    '''
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=args.threads)
+    try:
+        future_to_host = {executor.submit(exchange_lib.check_host, host,
+                                          args.cves, args.timeout,
+                                          scheme=args.scheme,
+                                          method=args.method,
+                                          path=args.path,
+                                          debug=args.debug): host for host in hosts}
+        for future in concurrent.futures.as_completed(future_to_host):
+            host = future_to_host[future]
+            try: 
+                on_result(host, *future.result())
+            except Exception as e:
+                print('Exception occured:', e)
+    finally:
+        # Don't start hosts which are still queued if interrupted
+        executor.shutdown(wait=False, cancel_futures=True)
+# end scan_threads
 
 def main():
     parser = argparse.ArgumentParser()
-    parser.add_argument('cve', type=str.lower, choices = 
-                        ['cve-2021-26855', 'cve-2021-34473',
-                        'cve--2021-33766'], 
-                        help='The CVE number to scan for.')
+    parser.add_argument('cves', metavar='cve', nargs='+', type=str.lower,
+                        choices=list(exchange_lib.CHECKS),
+                        help='The CVE numbers to scan for. Each host is'
+                        ' fingerprinted once for all of them.')
     parser.add_argument('hostlist', type=argparse.FileType('r'),
                         help='List of IPs/hostnames to scan. One'
-                        ' IP/hostname per line')
-    parser.add_argument('results', type=argparse.FileType('w'),
+                        ' IP/hostname/network in CIDR notation per line')
+    parser.add_argument('results',
                         help='CSV file to write vulnerable hosts to.'
                         ' Format: "ip","timestamp","exchange_version_number",'
-                        'exchange_version_name"')
-    parser.add_argument('--method', default='GET', 
-                        help='The HTTP method to use. Default: "GET"')
+                        '"exchange_version_name","cve"')
+    parser.add_argument('--method',
+                        help='The HTTP method to use. Default: The default'
+                        ' of the CVE check.')
     parser.add_argument('--timeout', type=int, default=2,
                         help='The timeout to use for requests in seconds.'
                         ' Default: 2')
-    parser.add_argument('--scheme', choices=['https://', 'http://'], 
+    parser.add_argument('--scheme', choices=['https://', 'http://'],
+                        default='https://',
                         help='Scheme of the request, i.e. "http://" or'
-                        ' "https://".')
-    parser.add_argument('--path', help='The path on the webserver.')
+                        ' "https://". Default: "https://"')
+    parser.add_argument('--path', help='The path on the webserver. Only'
+                        ' allowed when scanning for a single CVE. Default:'
+                        ' The default of the CVE check.')
     parser.add_argument('--threads', type=int, default=300,
                         help='Max number of parallel requests. Default:'
                         ' 300')
-    parser.add_argument('--patched', type=argparse.FileType('w'),
+    parser.add_argument('--engine', choices=['threads', 'asyncio'],
+                        default='threads',
+                        help='Run the requests in a thread pool or with'
+                        ' asyncio. The asyncio engine needs aiohttp.'
+                        ' Default: "threads"')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], default='csv',
+                        help='Format of the results. "jsonl" writes one'
+                        ' line per host with the results of all CVEs, the'
+                        ' timings of each request and the cause of failed'
+                        ' requests to the results file, followed by a'
+                        ' summary of throughput and latency. Default:'
+                        ' "csv"')
+    parser.add_argument('--patched',
                         help='File to write patched hosts to.')
-    parser.add_argument('--unknown', type=argparse.FileType('w'),
+    parser.add_argument('--unknown',
                         help='File to write hosts to whose status is not'
                         ' known (e.g. not an Exchange, OWA not active).')
+    parser.add_argument('--no-resolve', action='store_true',
+                        help='Don\'t resolve the host list. By default,'
+                        ' hosts with the same address are only scanned'
+                        ' once and listed IPs are scanned by their name'
+                        ' if their reverse lookup resolves back to them.'
+                        ' Each hostname costs one lookup; addresses from'
+                        ' expanded networks are never reverse-resolved.')
+    parser.add_argument('--checkpoint',
+                        help='File to record completed hosts in. Default:'
+                        ' The results file with ".checkpoint" appended.')
+    parser.add_argument('--resume', action='store_true',
+                        help='Skip the hosts in the checkpoint file and'
+                        ' append to the result files of the previous run.')
+    parser.add_argument('--versions-db', default=gev.DEFAULT_DATABASE,
+                        help='JSON file with the Exchange build numbers.'
+                        f' Default: {gev.DEFAULT_DATABASE}')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Download the Exchange build numbers and'
+                        ' update the versions database before scanning.')
     parser.add_argument('--debug', action='store_true', help='Print debug'
                         ' information.')
 
     args = parser.parse_args()
+    args.cves = list(dict.fromkeys(args.cves))
+    if len(args.cves) > 1 and (args.path or args.method):
+        parser.error('--path and --method need a single CVE')
+    if args.engine == 'asyncio':
+        try:
+            import asyncio
+            import exchange_async
+        except ImportError as e:
+            parser.error(f'The asyncio engine needs aiohttp: {e}')
+    if args.format == 'jsonl' and (args.patched or args.unknown):
+        parser.error('--patched and --unknown are written to the results'
+                     ' file with --format jsonl')
+    if args.checkpoint is None:
+        if args.results == '-':
+            parser.error('--checkpoint is needed when writing results to'
+                         ' stdout')
+        args.checkpoint = args.results + '.checkpoint'
 
     timestamp = datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds')
-    vulnerable = []
-    patched = []
-    unknown = []
-
-    hosts = []
-    for line in args.hostlist.readlines():
-        host = line.strip()
-        hosts.append(host)
-
-    headers = {
-      'User-Agent' : 'get_list_of_exchange_versions'
-    }
-    soup = gev.get_soup('https://docs.microsoft.com/en-us/exchange/new-features/build-numbers-and-release-dates',
-                        headers)
-    tables = gev.get_tables(soup)
-    exchange_mappings = gev.combine_dicts(tables, 'number_to_name', debug=args.debug)
-
-    if args.cve == 'cve-2021-26855':
-        is_vulnerable = exchange_lib.is_vulnerable_to_cve_2021_26855
-    elif args.cve == 'cve-2021-34473':
-        is_vulnerable = exchange_lib.is_vulnerable_to_cve_2021_34473
-    elif args.cve == 'cve-2021-33766':
-        is_vulnerable = exchange_lib.is_vulnerable_to_cve_2021_33766
-    with concurrent.futures.ThreadPoolExecutor(max_workers=args.threads) as executor:
-        future_to_host = {executor.submit(is_vulnerable, host, args.timeout,
-                                        args.method,scheme=args.scheme,
-                                        path=args.path, debug=args.debug): host for host in hosts}
-        for future in concurrent.futures.as_completed(future_to_host):
-            host = future_to_host[future]
-            try: 
-                version = future.result()[1]
-                if version == None:
-                    name = ''
-                else:
-                    found = False
-                    for key in exchange_mappings.keys():
-                        if key.startswith(version):
-                            found = True
-                            name = exchange_mappings[key]
-                            if len(version.split('.')) == 3:
-                                name_list = name.split(' ')
-                                if name_list[-1].startswith('CU') or name_list[-1] in ['Preview', 'RTM']:
-                                    pass
-                                else:
-                                    name = ' '.join(name_list[0:len(name_list)-1])
-                            break
-                    if not found:
-                        name = ''
-                if future.result()[0]:
-                    vulnerable.append([host, timestamp, version, name])
-                elif future.result()[0] == False:
-                    patched.append([host, timestamp, version, name])
-                else:
-                    unknown.append([host, timestamp, version, name])
-            except Exception as e:
-                print('Exception occured:', e)
 
-    writer = csv.writer(args.results, dialect='unix')
-    writer.writerows(vulnerable)
+    done = set()
+    if args.resume:
+        done = load_checkpoint(args.checkpoint)
+        for path in (args.results, args.patched, args.unknown):
+            if path and path != '-':
+                prune_results(path, done, args.format)
+        if args.debug:
+            print(f'Resuming, skipping {len(done)} completed hosts',
+                  file=sys.stderr)
+
+    hosts = hostlist.prepare_hosts(args.hostlist,
+                                   resolve_names=not args.no_resolve,
+                                   debug=args.debug)
+    hosts = [host for host in hosts if host not in done]
+
+    database = gev.get_database(args.versions_db, refresh=args.refresh,
+                                timeout=args.timeout, debug=args.debug)
+    if database is None:
+        # The checks only need the build numbers, the database just adds
+        # the product names to the results
+        print(f'[-] No Exchange versions database at "{args.versions_db}",'
+              ' results will not include version names. Run with'
+              ' --refresh while online to create it.', file=sys.stderr)
+        version_index = {}
+    else:
+        version_index = gev.build_version_index(database, debug=args.debug)
 
-    if args.patched:
-        writer = csv.writer(args.patched, dialect='unix')
-        writer.writerows(patched)
-    if args.unknown:
-        writer = csv.writer(args.unknown, dialect='unix')
-        writer.writerows(unknown)
+    output = ResultWriter(args.results, args.patched, args.unknown,
+                          args.checkpoint, version_index, timestamp,
+                          resume=args.resume, output_format=args.format)
+    try:
+        if args.engine == 'asyncio':
+            asyncio.run(exchange_async.scan(hosts, args.cves, output.record,
+                                            limit=args.threads,
+                                            timeout=args.timeout,
+                                            scheme=args.scheme,
+                                            method=args.method,
+                                            path=args.path,
+                                            debug=args.debug))
+        else:
+            scan_threads(hosts, args, output.record)
+    except KeyboardInterrupt:
+        print('Interrupted, run again with --resume to continue.',
+              file=sys.stderr)
+        sys.exit(130)
+    finally:
+        output.close()
 
 if __name__ == '__main__':
     main()